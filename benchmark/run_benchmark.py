@@ -0,0 +1,160 @@
+from __future__ import division
+from os import path, makedirs
+from tempfile import mkdtemp
+from datetime import datetime
+from subprocess import check_output, CalledProcessError
+import codecs, json, argparse, shutil, platform, sys
+import numpy as np
+
+sys.path.append( path.join(path.dirname(path.abspath(__file__)), "..") )
+from combinatorial_ngrams import load_resources, read_file, sentence_spans, clean_sentence_list, find_shared_words, integerize_words, id_bits
+from combinatorial_ngrams import id_list_ngram_rows, pack_ngrams, sort_postings, count_packed_sentence_matches, count_sparse_sentence_matches, match_lines
+from synthetic_corpus import seed_material, generate_pair, write_pair, read_planted
+import profiling
+
+'''Time each stage of the matching pipeline on a synthetic pair of texts with planted reuse, measure how many of the
+planted sentence pairs it recovers, and save the results as JSON so that runs can be compared over time.
+
+Run from the root of the repository: `python benchmark/run_benchmark.py`'''
+
+RESULTS_DIR = path.join("benchmark", "results")
+
+#####################
+# Measuring Methods #
+#####################
+
+def run_pipeline(text_files, output_path, window_size, step_size, ngram_size, threshold=5, engine="packed"):
+	'''Read in the paths of two texts, the path of the matches file to write, the combinatorial parameters, the threshold and the engine, run each stage of the pipeline in turn under the profiler, and return the profiler's report, the sentence spans of both texts and the matched (sentence_id_one, sentence_id_two, count) triples'''
+	profiler = profiling.enable()
+	with profiling.stage("load_resources"):
+		load_resources()
+	with profiling.stage("read_file", len(text_files)):
+		texts = [read_file(text_file) for text_file in text_files]
+	spans     = [sentence_spans(text) for text in texts]
+	sentences = [ [text[start:end] for start, end in text_spans.tolist()] for text, text_spans in zip(texts, spans) ]
+	with profiling.stage("clean_words", sum(len(text_sentences) for text_sentences in sentences)):
+		cleaned = [clean_sentence_list(text_sentences) for text_sentences in sentences]
+
+	word_to_int = integerize_words( set(w for words in cleaned[0] for w in words) & set(w for words in cleaned[1] for w in words) )
+	postings    = []
+	for text_words in cleaned:
+		ngram_rows, sentence_ids = id_list_ngram_rows( [find_shared_words(words, word_to_int) for words in text_words], window_size, step_size, ngram_size )
+		with profiling.stage("pack_ngrams", len(sentence_ids)):
+			postings.append( sort_postings(pack_ngrams(ngram_rows, id_bits(len(word_to_int))), sentence_ids) )
+
+	if engine == "sparse":
+		matches = count_sparse_sentence_matches(postings, threshold=threshold)
+	else:
+		matches = count_packed_sentence_matches(postings, threshold)
+
+	with profiling.stage("write", len(matches)), codecs.open(output_path, "w", "utf-8") as out:
+		for line in match_lines(matches, text_files[0], text_files[1], sentences, threshold):
+			out.write(line)
+	return profiler.report(), spans, matches
+
+def planted_sentence_pairs(planted, spans):
+	'''Read in the character offsets of the planted pairs and the sentence spans of both texts, and return the set of (sentence_id_one, sentence_id_two) pairs the planted sentences fall in'''
+	starts = [ text_spans[:, 0] for text_spans in spans ]
+	return set( (int(np.searchsorted(starts[0], one, side="right")) - 1, int(np.searchsorted(starts[1], two, side="right")) - 1) for one, two in planted )
+
+def precision_recall(found, planted):
+	'''Read in the sets of found and planted sentence pairs, and return the share of found pairs that were planted and the share of planted pairs that were found'''
+	true_positives = len(found & planted)
+	precision = true_positives / len(found) if found else 1.0
+	recall    = true_positives / len(planted) if planted else 1.0
+	return precision, recall
+
+def git_commit():
+	'''Return the commit the repository is checked out at, or None if it cannot be found'''
+	try:
+		return check_output( ["git", "rev-parse", "HEAD"], cwd=path.dirname(path.abspath(__file__)) ).strip()
+	except (OSError, CalledProcessError):
+		return None
+
+#####################
+# Reporting Methods #
+#####################
+
+def print_report(result, baseline=None):
+	'''Read in a benchmark result and optionally an earlier one, and print each stage's time and the recovery of planted pairs, along with the change from the earlier run'''
+	baseline_seconds = dict( (stage["stage"], stage["seconds"]) for stage in baseline["stages"] ) if baseline else {}
+	for stage in result["stages"] + [ {"stage": "total", "seconds": result["total_seconds"]} ]:
+		line = "%-24s %9.3fs" % (stage["stage"], stage["seconds"])
+		earlier = baseline["total_seconds"] if baseline and stage["stage"] == "total" else baseline_seconds.get(stage["stage"])
+		if earlier:
+			line += "   %5.2fx baseline" % (stage["seconds"] / earlier)
+		print line
+
+	print "peak RSS                 %9d kB" % result["peak_rss_kb"]
+	for measure in ["precision", "recall"]:
+		line = "%-24s %9.4f" % (measure, result[measure])
+		if baseline:
+			line += "   %+.4f vs baseline" % (result[measure] - baseline[measure])
+		print line
+
+def parse_arguments():
+	'''Read the command line arguments and return them as a namespace'''
+	parser = argparse.ArgumentParser(description="Benchmark the matching pipeline on synthetic texts with planted reuse")
+	parser.add_argument("--window-size", type=int, default=8, help="the size of the sliding window to be created (default 8)")
+	parser.add_argument("--step-size", type=int, default=4, help="number of words to advance the sliding window when it moves (default 4)")
+	parser.add_argument("--ngram-size", type=int, default=4, help="number of words to include in each ngram (default 4)")
+	parser.add_argument("--threshold", type=int, default=5, help="number of ngrams a sentence pair must share more than to count as a match (default 5)")
+	parser.add_argument("--engine", choices=["packed", "sparse"], default="packed", help="the engine used to count shared ngrams (default packed)")
+	parser.add_argument("--sentences", type=int, default=2000, help="number of background sentences in each synthetic text (default 2000)")
+	parser.add_argument("--passages", type=int, default=100, help="number of passages planted in both texts (default 100)")
+	parser.add_argument("--passage-length", type=int, default=3, help="largest number of sentences in a planted passage (default 3)")
+	parser.add_argument("--noise", type=float, default=.2, help="share of the words of each planted sentence that are dropped, replaced or swapped (default .2)")
+	parser.add_argument("--seed", type=int, default=1, help="random seed of the synthetic texts (default 1)")
+	parser.add_argument("--corpus-dir", help="keep the synthetic texts and their matches in this directory instead of a temporary one")
+	parser.add_argument("--output", help="path of the JSON results file (default benchmark/results/{timestamp}.json)")
+	parser.add_argument("--baseline", help="path of an earlier JSON results file to compare this run with")
+	return parser.parse_args()
+
+if __name__ == "__main__":
+
+	args       = parse_arguments()
+	corpus_dir = args.corpus_dir or mkdtemp(prefix="benchmark-")
+	created    = datetime.now()
+
+	sentences, words = seed_material()
+	text_one, text_two, planted = generate_pair( sentences, words, args.sentences, args.passages, args.passage_length, args.noise, args.seed )
+	write_pair(corpus_dir, text_one, text_two, planted)
+
+	text_files = [ path.join(corpus_dir, "text_one.txt"), path.join(corpus_dir, "text_two.txt") ]
+	report, spans, matches = run_pipeline( text_files, path.join(corpus_dir, "matches.txt"), args.window_size, args.step_size, args.ngram_size, args.threshold, args.engine )
+	planted_pairs = planted_sentence_pairs(read_planted(corpus_dir), spans)
+	found_pairs   = set( (sentence_id_one, sentence_id_two) for sentence_id_one, sentence_id_two, count in matches )
+	precision, recall = precision_recall(found_pairs, planted_pairs)
+
+	if not args.corpus_dir:
+		shutil.rmtree(corpus_dir)
+
+	parameters = dict( (name, value) for name, value in vars(args).iteritems() if name not in ["corpus_dir", "output", "baseline"] )
+	result = {
+		"created":        created.isoformat(),
+		"commit":         git_commit(),
+		"python":         platform.python_version(),
+		"parameters":     parameters,
+		"sentences":      [len(text_spans) for text_spans in spans],
+		"stages":         report["stages"],
+		"total_seconds":  report["total_seconds"],
+		"peak_rss_kb":    report["peak_rss_kb"],
+		"planted_pairs":  len(planted_pairs),
+		"matched_pairs":  len(found_pairs),
+		"true_positives": len(found_pairs & planted_pairs),
+		"precision":      precision,
+		"recall":         recall
+	}
+
+	output_path = args.output or path.join( RESULTS_DIR, created.strftime("%Y%m%d-%H%M%S") + ".json" )
+	if path.dirname(output_path) and not path.exists(path.dirname(output_path)):
+		makedirs(path.dirname(output_path))
+	with open(output_path, "w") as out:
+		json.dump(result, out, indent=2, sort_keys=True)
+
+	baseline = None
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+	print_report(result, baseline)
+	print "results written to", output_path
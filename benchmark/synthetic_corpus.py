@@ -0,0 +1,105 @@
+from __future__ import division
+from os import path, makedirs
+import codecs, random, argparse, sys
+
+sys.path.append( path.join(path.dirname(path.abspath(__file__)), "..") )
+from combinatorial_ngrams import read_file, sentence_split
+
+'''Generate a pair of synthetic texts in which known passages of the first text reappear, paraphrased and reordered, in the second.
+
+The background sentences of both texts are random sequences of words drawn from the seed text, so the two texts share
+almost nothing by accident; the planted passages are real sentences of the seed text. Each planted pair is recorded by
+the character offsets at which its two sentences begin, so that it can be matched against whatever sentences the
+pipeline's sentence splitter finds.'''
+
+SEED_PATH = path.join("sample", "goldsmith_animated_nature_full_unsplit.txt")
+
+def seed_material(seed_path=SEED_PATH):
+	'''Read in the path of the seed text, and return its sentences of at least twelve words along with every alphabetic word it contains, in reading order'''
+	sentences = sentence_split( read_file(seed_path) )
+	words     = [w.lower() for sentence in sentences for w in sentence.split() if w.isalpha()]
+	return [sentence for sentence in sentences if len(sentence.split()) >= 12], words
+
+def background_sentence(sentences, words, generator):
+	'''Read in the seed sentences and words and a random generator, and return a sentence as long as a random seed sentence whose words are drawn at random from the seed text'''
+	length = len( generator.choice(sentences).split() )
+	return " ".join( [generator.choice(words) for i in xrange(length)] ).capitalize() + "."
+
+def paraphrase(sentence, noise, words, generator):
+	'''Read in a sentence, the share of its words to disturb, the seed words and a random generator, and return the sentence with words dropped, replaced by seed words, or swapped with their neighbour'''
+	paraphrased = []
+	for w in sentence.split():
+		draw = generator.random()
+		if draw < noise / 3:
+			continue
+		paraphrased.append( generator.choice(words) if draw < 2 * noise / 3 else w )
+
+	for i in xrange(len(paraphrased) - 1):
+		if generator.random() < noise / 3:
+			paraphrased[i], paraphrased[i + 1] = paraphrased[i + 1], paraphrased[i]
+	return " ".join(paraphrased)
+
+def generate_pair(sentences, words, text_sentences=2000, passages=100, passage_length=3, noise=.2, seed=1):
+	'''Read in the seed sentences and words, the number of background sentences in each text, the number of planted passages and the most sentences in each, the share of words to disturb, and a random seed, and return the sentences of both texts along with the (sentence_one, sentence_two) positions of every planted pair'''
+	generator = random.Random(seed)
+	texts     = [ [background_sentence(sentences, words, generator) for i in xrange(text_sentences)] for text in xrange(2) ]
+	planted   = []
+	# Passages start passage_length sentences apart so that no seed sentence is planted twice
+	originals = generator.sample( xrange(0, len(sentences) - passage_length, passage_length), passages )
+
+	# Inserting a passage shifts every sentence already planted after it in either text
+	inserts = sorted( [ (generator.randint(0, text_sentences), generator.randint(0, text_sentences), start) for start in originals ], reverse=True )
+	for position_one, position_two, start in inserts:
+		passage = sentences[start:start + generator.randint(1, passage_length)]
+		order   = range(len(passage))
+		generator.shuffle(order)
+		texts[0][position_one:position_one] = passage
+		texts[1][position_two:position_two] = [ paraphrase(passage[i], noise, words, generator) for i in order ]
+		planted = [ (one + len(passage) * (one >= position_one), two + len(passage) * (two >= position_two)) for one, two in planted ]
+		planted.extend( (position_one + i, position_two + order.index(i)) for i in xrange(len(passage)) )
+	return texts[0], texts[1], sorted(planted)
+
+def sentence_offsets(sentences):
+	'''Read in a list of sentences and return the character offset at which each begins once they are joined by single spaces'''
+	offsets = []
+	offset  = 0
+	for sentence in sentences:
+		offsets.append(offset)
+		offset += len(sentence) + 1
+	return offsets
+
+def write_pair(output_dir, text_one, text_two, planted):
+	'''Read in an output directory, the sentences of two texts and their planted pairs, and write text_one.txt, text_two.txt and planted.tsv (the character offsets of each planted pair) to that directory'''
+	if not path.exists(output_dir):
+		makedirs(output_dir)
+	for file_name, sentences in [ ("text_one.txt", text_one), ("text_two.txt", text_two) ]:
+		with codecs.open( path.join(output_dir, file_name), "w", "utf-8" ) as out:
+			out.write( " ".join(sentences) + "\n" )
+
+	offsets = [ sentence_offsets(text_one), sentence_offsets(text_two) ]
+	with codecs.open( path.join(output_dir, "planted.tsv"), "w", "utf-8" ) as out:
+		for sentence_one, sentence_two in planted:
+			out.write( unicode(offsets[0][sentence_one]) + "\t" + unicode(offsets[1][sentence_two]) + "\n" )
+
+def read_planted(output_dir):
+	'''Read in a directory written by write_pair() and return the list of (offset_one, offset_two) character offsets of its planted pairs'''
+	with codecs.open( path.join(output_dir, "planted.tsv"), "r", "utf-8" ) as f:
+		return [ tuple(int(offset) for offset in line.split("\t")) for line in f.read().split("\n")[:-1] ]
+
+def parse_arguments():
+	'''Read the command line arguments and return them as a namespace'''
+	parser = argparse.ArgumentParser(description="Write a pair of synthetic texts that share known paraphrased and reordered passages")
+	parser.add_argument("output_dir", help="directory in which text_one.txt, text_two.txt and planted.tsv will be written")
+	parser.add_argument("--sentences", type=int, default=2000, help="number of background sentences in each text (default 2000)")
+	parser.add_argument("--passages", type=int, default=100, help="number of passages planted in both texts (default 100)")
+	parser.add_argument("--passage-length", type=int, default=3, help="largest number of sentences in a planted passage (default 3)")
+	parser.add_argument("--noise", type=float, default=.2, help="share of the words of each planted sentence that are dropped, replaced or swapped (default .2)")
+	parser.add_argument("--seed", type=int, default=1, help="random seed (default 1)")
+	return parser.parse_args()
+
+if __name__ == "__main__":
+
+	args = parse_arguments()
+	sentences, words = seed_material()
+	text_one, text_two, planted = generate_pair( sentences, words, args.sentences, args.passages, args.passage_length, args.noise, args.seed )
+	write_pair(args.output_dir, text_one, text_two, planted)
@@ -0,0 +1,153 @@
+from bisect import bisect_left
+from os import path, makedirs, listdir
+import numpy as np
+import codecs, mmap
+
+'''Read the text cleaning resources (orthographic variants, stopwords, word frequencies), and compile them once into
+memory-mapped sorted string tables so that processes start without parsing the text files and share one copy of their pages.
+
+To compile the resources, run `python cleaning_resources.py` from the root of the repository. A compiled table is used
+instead of the text file it was built from only while it is at least as new as that file; after the text file is edited it
+is read again until the resources are recompiled.'''
+
+RESOURCE_DIR   = "text_cleaning_resources"
+COMPILED_DIR   = path.join(RESOURCE_DIR, "compiled")
+ORTHO_PATH     = path.join(RESOURCE_DIR, "orthographic_variants.txt")
+STOPWORDS_PATH = path.join(RESOURCE_DIR, "underwood_stopwords.txt")
+STATS_PATH     = path.join(RESOURCE_DIR, "normalized_stats_one_million.txt")
+RESOURCE_PATHS = [ORTHO_PATH, STOPWORDS_PATH, STATS_PATH]
+
+# The text file each compiled table is built from
+TABLE_SOURCES = {"orthographic_variants": ORTHO_PATH, "stopwords": STOPWORDS_PATH, "frequencies": STATS_PATH}
+
+#######################
+# Text Format Methods #
+#######################
+
+def read_ortho_variants(file_path):
+	'''Read in the path of a tab-separated file of spelling variants and their controlled representations, and return that mapping as a dictionary'''
+	ortho_dict = {}
+	with codecs.open(file_path,"r","utf-8") as ortho:
+		ortho = ortho.read().replace("\r","").lower().split("\n")[:-1]
+		for row in ortho:
+			sr = row.split("\t")
+			ortho_dict[ sr[0] ] = sr[1]
+	return ortho_dict
+
+def read_stopwords(file_path):
+	'''Read in the path of a whitespace-separated stopword list and return it as a set'''
+	with codecs.open(file_path,"r","utf-8") as stopwords_in:
+		return set(stopwords_in.read().split())
+
+def read_frequencies(file_path):
+	'''Read in the path of a tab-separated file of words and their relative frequencies, and return that mapping as a dictionary'''
+	stats_dict = {}
+	with codecs.open(file_path,'r','utf-8') as f:
+		f = f.read().split("\n")[:-1]
+		for row in f:
+			sr = row.split("\t")
+			stats_dict[ sr[0] ] = float( sr[1] )
+	return stats_dict
+
+###########################
+# Compiled Format Methods #
+###########################
+
+def write_strings(prefix, strings):
+	'''Read in a path prefix and a list of unicode strings, and write their UTF-8 bytes end to end (prefix.bin) along with the offset at which each begins (prefix.offsets.npy)'''
+	encoded = [s.encode("utf-8") for s in strings]
+	with open(prefix + ".bin", "wb") as out:
+		out.write( b"".join(encoded) )
+	np.save( prefix + ".offsets.npy", np.cumsum([0] + [len(s) for s in encoded]).astype(np.int64) )
+
+def compile_table(compiled_dir, name, keys, values=None):
+	'''Read in an output directory, a table name, a collection of unicode keys and an optional mapping of those keys to strings or floats, and write a sorted string table to disk'''
+	keys = sorted(keys, key=lambda k: k.encode("utf-8"))
+	write_strings( path.join(compiled_dir, name + ".keys"), keys )
+	if values is None:
+		return
+	if all(isinstance(values[k], float) for k in keys):
+		np.save( path.join(compiled_dir, name + ".values.npy"), np.array([values[k] for k in keys], dtype=np.float64) )
+	else:
+		write_strings( path.join(compiled_dir, name + ".values"), [values[k] for k in keys] )
+
+def compile_resources(compiled_dir=COMPILED_DIR):
+	'''Read the text cleaning resources and write each as a compiled table to `compiled_dir`'''
+	if not path.exists(compiled_dir):
+		makedirs(compiled_dir)
+	ortho_dict = read_ortho_variants(ORTHO_PATH)
+	stats_dict = read_frequencies(STATS_PATH)
+	compile_table( compiled_dir, "orthographic_variants", ortho_dict.keys(), ortho_dict )
+	compile_table( compiled_dir, "stopwords", read_stopwords(STOPWORDS_PATH) )
+	compile_table( compiled_dir, "frequencies", stats_dict.keys(), stats_dict )
+
+class StringList(object):
+	'''A read-only list of UTF-8 byte strings backed by a memory-mapped byte blob and an offsets array'''
+
+	def __init__(self, prefix):
+		'''Read in the path prefix of a pair of files written by write_strings()'''
+		self.offsets = np.load(prefix + ".offsets.npy", mmap_mode="r")
+		with open(prefix + ".bin", "rb") as f:
+			# mmap refuses to map an empty file
+			self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if path.getsize(prefix + ".bin") else b""
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, i):
+		return self.blob[ int(self.offsets[i]):int(self.offsets[i + 1]) ]
+
+class CompiledTable(object):
+	'''A memory-mapped sorted string table that answers membership tests and (when it has values) dictionary-style lookups'''
+
+	def __init__(self, compiled_dir, name):
+		'''Read in the directory and name of a table written by compile_table()'''
+		prefix      = path.join(compiled_dir, name)
+		self.keys   = StringList(prefix + ".keys")
+		self.values = None
+		if path.exists(prefix + ".values.npy"):
+			self.values = np.load(prefix + ".values.npy", mmap_mode="r")
+		elif path.exists(prefix + ".values.bin"):
+			self.values = StringList(prefix + ".values")
+
+	def find(self, word):
+		'''Read in a unicode word and return its position in the table, or -1 if it is absent'''
+		key = word.encode("utf-8")
+		i   = bisect_left(self.keys, key)
+		if i < len(self.keys) and self.keys[i] == key:
+			return i
+		return -1
+
+	def __contains__(self, word):
+		return self.find(word) >= 0
+
+	def __getitem__(self, word):
+		i = self.find(word)
+		if i < 0:
+			raise KeyError(word)
+		if isinstance(self.values, StringList):
+			return self.values[i].decode("utf-8")
+		return float(self.values[i])
+
+	def get(self, word, default=None):
+		try:
+			return self[word]
+		except KeyError:
+			return default
+
+def resource_files():
+	'''Return the paths of every text and compiled resource file present on disk, in a stable order'''
+	compiled_files = [path.join(COMPILED_DIR, f) for f in sorted(listdir(COMPILED_DIR))] if path.exists(COMPILED_DIR) else []
+	return [p for p in RESOURCE_PATHS if path.exists(p)] + compiled_files
+
+def compiled_table_current(name, compiled_dir=COMPILED_DIR):
+	'''Read in a table name and return True if a compiled version of that table exists and is at least as new as the text file it was built from'''
+	table_path  = path.join(compiled_dir, name + ".keys.offsets.npy")
+	source_path = TABLE_SOURCES[name]
+	if not path.exists(table_path):
+		return False
+	return not path.exists(source_path) or path.getmtime(table_path) >= path.getmtime(source_path)
+
+if __name__ == "__main__":
+
+	compile_resources()
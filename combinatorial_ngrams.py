@@ -1,12 +1,29 @@
 from __future__ import division
 from nltk.stem.wordnet import WordNetLemmatizer
-from collections import deque, defaultdict, Counter
-from itertools import islice, combinations
+from collections import defaultdict, Counter
+from itertools import combinations, chain
 from nltk.util import ngrams
 from regex import sub
-from nltk import data
+from cleaning_resources import read_ortho_variants, read_stopwords, read_frequencies, compiled_table_current, resource_files, CompiledTable
+from cleaning_resources import COMPILED_DIR, ORTHO_PATH, STOPWORDS_PATH, STATS_PATH
+from word_memo import WordMemo
+from profiling import stage
+import profiling
+from ngram_postings import NgramPostings, find_keys
+from key_filters import build_key_filter
+from minhash_lsh import minhash_signatures, band_keys
+from scipy.sparse import csr_matrix
+from document_cache import file_digest, cache_key, load_entry, store_entry
+from match_store import create_store, raw_byte_spans, token_starts, utf8_offsets, DocumentSentences
+from external_sort import write_runs, merge_runs
+from nltk import data, __version__ as nltk_version
+from multiprocessing import Pool
 from os import path, remove
-import sys, codecs, operator
+from tempfile import mkdtemp
+from shutil import rmtree
+from numpy.lib.stride_tricks import as_strided
+import numpy as np
+import codecs, argparse, math
 
 '''Read in two files specified at the command line and calculate the number of shared words within subregions of those texts'''
 
@@ -21,33 +38,39 @@ def read_file(file_path):
 	f.close()
 	return file_contents
 
+def get_resource(name):
+	'''Read in the name of a cleaning resource and return that resource, loading it on first use'''
+	try:
+		return resources[name]
+	except KeyError:
+		with stage("load_" + name):
+			resources[name] = RESOURCE_LOADERS[name]()
+		return resources[name]
+
+def load_resources():
+	'''Load every cleaning resource that has not been loaded yet'''
+	for name in RESOURCE_LOADERS:
+		get_resource(name)
+
 def create_ortho_dict():
-	'''Create mapping from spelling variant to controlled representation (orthographically-normalized representation) of word'''
-	ortho_dict = {}
-	with codecs.open("text_cleaning_resources/orthographic_variants.txt","r","utf-8") as ortho:
-		ortho = ortho.read().replace("\r","").lower().split("\n")[:-1]
-		for row in ortho:
-			sr = row.split("\t")
-			ortho_dict[ sr[0] ] = sr[1]
-	return ortho_dict
+	'''Create mapping from spelling variant to controlled representation (orthographically-normalized representation) of word, memory-mapping the compiled table if it is up to date'''
+	if compiled_table_current("orthographic_variants"):
+		return CompiledTable(COMPILED_DIR, "orthographic_variants")
+	return read_ortho_variants(ORTHO_PATH)
 	
 def standardize_spelling(w):
 	'''Read in a word and return an orthograpically normalized representation of the word'''
 	try:
-		return ortho_dict[w]
+		return get_resource("ortho_dict")[w]
 	except:
 		return w
 
 def create_stopwords():
-	'''Generate stopword list compiled by Ted Underwood'''
-	with codecs.open("text_cleaning_resources/underwood_stopwords.txt","r","utf-8") as stopwords_in:		
-		stopwords = set(stopwords_in.read().split())
-		return stopwords
+	'''Generate stopword list compiled by Ted Underwood, memory-mapping the compiled table if it is up to date'''
+	if compiled_table_current("stopwords"):
+		return CompiledTable(COMPILED_DIR, "stopwords")
+	return read_stopwords(STOPWORDS_PATH)
 		
-def remove_stopwords(l):
-	'''Read in a list of words and return that list sans stopwords'''
-	return [w for w in l if w not in stopwords and len(w) > 1]
-	
 def remove_punctuation(s):
 	'''Read in a string and return that strip without any punctuation except the hyphen and en-dash'''
 	return sub(ur"[^\P{P}']+", " ", s)
@@ -58,67 +81,52 @@ def remove_digits(s):
 		
 def lemmatize_word(w):
 	'''Read in a single word and return it in its lemmatized state'''
-	return lemmatizer.lemmatize(w)
+	with stage("lemmatize", 1):
+		return get_resource("lemmatizer").lemmatize(w)
 
 def sentence_split(s):
 	'''Read in a string and return an iterable, each member of which is a sentence in that file'''
-	return tokenizer.tokenize(s)	
+	with stage("sentence_split") as split:
+		sentences = get_resource("tokenizer").tokenize(s)
+		split.items = len(sentences)
+	return sentences
+
+def sentence_spans(s):
+	'''Read in a string and return a 2-D array holding the (start, end) character offsets of each sentence_split() sentence in that string'''
+	with stage("sentence_split") as split:
+		spans = np.array( list(get_resource("tokenizer").span_tokenize(s)), dtype=np.int64 ).reshape(-1, 2)
+		split.items = len(spans)
+	return spans
 
-def remove_common_words(l):
-	'''Read in a list of words and return a list of sufficiently uncommon words in the list'''
-	return [w for w in l if retrieve_frequency(w) < .9]
-	
 #########################
 # Combinatorial Methods #
 #########################	
 		
-def sliding_window(iterable, size=10, step=5, fillvalue=None):
-	'''Read in an iterable and return a generator with windows of size `size`, using the specified step and fill values'''
-	if size < 0 or step < 1:
-		raise ValueError
-	it = iter(iterable)
-	q = deque(islice(it, size), maxlen=size)
-	if not q:
-		return  # empty iterable or size == 0
-	q.extend(fillvalue for _ in range(size - len(q)))  # pad to size
-	while True:
-		yield iter(q)  # iter() to avoid accidental outside modifications
-		q.append(next(it))
-		q.extend(next(it, fillvalue) for _ in range(step - 1))
-
-def word_combinations( word_list, size_val=int(sys.argv[3]), step_val=int(sys.argv[4]), combination_length_val=int(sys.argv[5]) ):
-	'''Read in a list of words and return combinations of those words matching the user-supplied arguments:
-	sys.argv[3] is the window size, 
-	sys.argv[4] is the step interval, 
-	sys.argv[5] is the length of each tuple to be compared'''
-	ngram_list = []
-	
-	for w in sliding_window( word_list, size=size_val, step=step_val):
-		for c in combinations(w, combination_length_val):
-			if None not in c:
-				# Sort the tuples into alphabetic order (for dimension reduction)
-				ngram_list.append( tuple( sorted(c) ) )
-
-	return set(ngram_list)
+def normalize_word(w):
+	'''Read in a single lowercase word and return it with its spelling standardized and lemmatized, or None if it is a stopword or too common to be informative'''
+	w = standardize_spelling(w)
+	if w in get_resource("stopwords") or len(w) <= 1:
+		return None
+	w = lemmatize_word(w)
+	if retrieve_frequency(w) < .9:
+		return w
+	return None
 
 def clean_words(s):
-	'''Read in a string and return a clean array of words in that string'''
+	'''Read in a string and return a clean array of words in that string; each distinct word is normalized only once per process'''
 	l = remove_digits( remove_punctuation( s.lower()) ).split()
-	l = (standardize_spelling(w) for w in l)
-	l = remove_stopwords(l)		
-	l = (lemmatize_word(w) for w in l)
-	l = remove_common_words(l)
-	return l	
+	return get_resource("word_memo").normalize_words(l)
 	
-def find_shared_words(s):
-	'''Read in a string and return words found in only one file'''
-	return [word_to_int[w] for w in s if w in shared_words]
+def find_shared_words(s, word_to_int):
+	'''Read in a list of words and a word-to-integer mapping, and return the integer ids of the words found in that mapping'''
+	return [word_to_int[w] for w in s if w in word_to_int]
 	
 def integerize_words(shared_words):
 	'''Read in a set of words and return a hash table that maps each word to an integer'''
 	word_to_integer = defaultdict()
 	word_to_integer.default_factory = lambda: len(word_to_integer)
-	for w in shared_words:
+	# Visit the words in sorted order so the same words always receive the same integers
+	for w in sorted(shared_words):
 		word_to_integer[w]
 	return word_to_integer
 	
@@ -127,101 +135,978 @@ def integerize_words(shared_words):
 #######################	
 	
 def populate_stats():
-	'''Read in a file containing the relative frequency of the 1M most common words in the English language and return in dictionary form'''
-	stats_dict = {}
-	with codecs.open("text_cleaning_resources/normalized_stats_one_million.txt",'r','utf-8') as f:
-		f = f.read().split("\n")[:-1]
-		for row in f:
-			sr = row.split("\t")
-			stats_dict[ sr[0] ] = float( sr[1] )
-			
-	return stats_dict
+	'''Read in a file containing the relative frequency of the 1M most common words in the English language and return in dictionary form, memory-mapping the compiled table if it is up to date'''
+	if compiled_table_current("frequencies"):
+		return CompiledTable(COMPILED_DIR, "frequencies")
+	return read_frequencies(STATS_PATH)
 	
 def retrieve_frequency(word):
 	'''Read in a word and return its relative frequency value'''
 	try:
-		return stats_dict[ word ]
+		return get_resource("stats_dict")[ word ]
 	except Exception as exc:
 		return .000001
 	
-def product(iterable):
-	'''Read in an iterable of numerical values and return the product of all those values'''
-	return reduce(operator.mul, iterable, 1)			
+#########################
+# Packed N-gram Methods #
+#########################
+
+def id_bits(vocabulary_size):
+	'''Read in the number of distinct word ids and return the number of bits required to store a single id'''
+	return max(1, int(vocabulary_size - 1).bit_length())
+
+def pack_ngrams(ngram_rows, bits):
+	'''Read in a 2-D array of sorted word-id tuples and return one fixed-width key per row: a uint64 if the tuple fits in 64 bits, else a raw big-endian row that sorts in the same order'''
+	ngram_rows = np.asarray(ngram_rows)
+	if ngram_rows.shape[1] * bits <= 64:
+		keys = np.zeros(len(ngram_rows), dtype=np.uint64)
+		for column in xrange(ngram_rows.shape[1]):
+			keys = (keys << np.uint64(bits)) | ngram_rows[:, column].astype(np.uint64)
+		return keys
+	rows = np.ascontiguousarray(ngram_rows, dtype=">u4")
+	return rows.view(np.dtype((np.void, rows.shape[1] * 4))).ravel()
+
+def unpack_ngrams(keys, bits, ngram_size):
+	'''Read in keys written by pack_ngrams(), the number of bits per id and the number of ids per key, and return the 2-D array of word-id tuples those keys encode'''
+	keys = np.ascontiguousarray(keys)
+	if keys.dtype.kind == "V":
+		return keys.view(">u4").reshape(-1, ngram_size).astype(np.uint32)
+	mask = np.uint64((1 << bits) - 1)
+	return np.stack( [(keys >> np.uint64(bits * (ngram_size - 1 - column))) & mask for column in xrange(ngram_size)], axis=1 ).astype(np.uint32)
+
+def sort_postings(keys, sentence_ids):
+	'''Read in aligned arrays of ngram keys and sentence ids and return both sorted by key (and by sentence id within a key)'''
+	order = np.argsort(keys, kind="mergesort")
+	return keys[order], sentence_ids[order]
+
+def combination_table(window_size, ngram_size):
+	'''Read in a window size and an ngram size, and return a C(window_size, ngram_size) x ngram_size array holding every combination of positions within a window, in itertools.combinations() order'''
+	return np.array( list(combinations(xrange(window_size), ngram_size)), dtype=np.intp ).reshape(-1, ngram_size)
+
+def window_counts(lengths, window_size, step_size):
+	'''Read in an array of sentence lengths, the window size and the step size, and return the number of windows in each sentence: one for a non-empty sentence, plus one more each time the window advances `step_size` words and reads at least one further word'''
+	if window_size < 0 or step_size < 1:
+		raise ValueError
+	lengths = np.asarray(lengths, dtype=np.int64)
+	if window_size == 0:
+		return np.zeros(len(lengths), dtype=np.int64)
+	return np.where( lengths > 0, 1 + np.maximum(0, -((window_size - lengths) // step_size)), 0 )
+
+def window_rows(id_lists, window_size, step_size):
+	'''Read in a list holding the word ids of each sentence, the window size and the step size, and return a 2-D array holding every `window_size`-word window of every sentence, each starting `step_size` words after the one before it, with -1 wherever a window runs past the end of its sentence, along with the position of the sentence each window came from'''
+	lengths = np.array( [len(ids) for ids in id_lists], dtype=np.int64 )
+	counts  = window_counts(lengths, window_size, step_size)
+	if not counts.sum():
+		return np.zeros( (0, window_size), dtype=np.int32 ), np.zeros(0, dtype=np.int64)
+	
+	# Follow each sentence with enough padding that even a window starting a step past its last word reads only padding
+	padding = max(window_size, step_size)
+	padded  = np.full( lengths.sum() + padding * len(lengths), -1, dtype=np.int32 )
+	padded[ np.arange(lengths.sum()) + np.repeat(np.arange(len(lengths)) * padding, lengths) ] = np.fromiter( (i for ids in id_lists for i in ids), dtype=np.int32, count=lengths.sum() )
+	sentence_starts = np.cumsum(lengths + padding) - lengths - padding
+	
+	# View every window-sized slice of the padded ids without copying, then gather the slices each sentence's windows start at
+	windows       = as_strided( padded, shape=(len(padded) - window_size + 1, window_size), strides=(padded.strides[0], padded.strides[0]) )
+	window_number = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+	window_starts = np.repeat(sentence_starts, counts) + window_number * step_size
+	return windows[window_starts], np.repeat(np.arange(len(lengths)), counts)
+
+def window_combination_rows(id_lists, window_size, step_size, ngram_size):
+	'''Read in a list holding the word ids of each sentence and the combinatorial parameters, and return every combination of `ngram_size` words within a window of each sentence as a 2-D array of sorted word-id rows, de-duplicated within each sentence, along with the position of the sentence each row came from'''
+	windows, window_sentences = window_rows(id_lists, window_size, step_size)
+	table        = combination_table(window_size, ngram_size)
+	rows         = windows[:, table].reshape(-1, ngram_size)
+	sentence_ids = np.repeat(window_sentences, len(table))
+	
+	# Combinations that reach into the padding are dropped, so the last window of a sentence only combines the words it holds
+	keep = (rows >= 0).all(axis=1)
+	if not keep.any():
+		return np.zeros( (0, ngram_size), dtype=np.uint32 ), np.zeros(0, dtype=np.uint32)
+	unique_rows = np.unique( np.column_stack((sentence_ids[keep], np.sort(rows[keep], axis=1))), axis=0 )
+	return unique_rows[:, 1:].astype(np.uint32), unique_rows[:, 0].astype(np.uint32)
+
+def id_list_ngram_rows(id_lists, window_size, step_size, ngram_size, workers=1, key_filter=None, block_windows=16384):
+	'''Read in a list holding the shared word ids of each sentence, and return a 2-D array of the sorted word-id ngrams in those sentences along with the (0-based) position of the sentence each row came from. Sentences are combined a block of about `block_windows` windows at a time to bound the memory the combinations take, and if a key filter is given, each block keeps only the ngrams whose packed keys the filter may hold'''
+	with stage("word_combinations", len(id_lists)):
+		if workers > 1 and len(id_lists) > 1:
+			return parallel_ngram_rows(id_list_ngram_chunk, id_lists, (window_size, step_size, ngram_size, 1, key_filter), workers)
+		
+		window_ends  = np.cumsum( window_counts([len(ids) for ids in id_lists], window_size, step_size) )
+		ngram_rows   = [ np.zeros((0, ngram_size), dtype=np.uint32) ]
+		sentence_ids = [ np.zeros(0, dtype=np.uint32) ]
+		start        = 0
+		while start < len(id_lists):
+			windows_before = window_ends[start - 1] if start else 0
+			stop = max( start + 1, int(np.searchsorted(window_ends, windows_before + block_windows, side="right")) )
+			rows, ids = window_combination_rows(id_lists[start:stop], window_size, step_size, ngram_size)
+			if key_filter is not None:
+				keep = key_filter.contains( pack_ngrams(rows, key_filter.bits) )
+				rows, ids = rows[keep], ids[keep]
+			ngram_rows.append(rows)
+			sentence_ids.append(ids + np.uint32(start))
+			start = stop
+		
+		return np.concatenate(ngram_rows), np.concatenate(sentence_ids)
+
+def sentence_ngram_rows(sentences, word_to_int, window_size, step_size, ngram_size, workers=1, key_filter=None):
+	'''Read in a list of sentences and a word-to-integer mapping, clean each sentence, and return the id_list_ngram_rows() of the words found in the mapping, keeping only the ngrams an optional key filter may hold'''
+	if workers > 1 and len(sentences) > 1:
+		# The workers clean each chunk and then generate its combinations, so the two steps can only be timed together here
+		with stage("clean_words_and_combinations", len(sentences)):
+			return parallel_ngram_rows(sentence_ngram_chunk, sentences, (dict(word_to_int), window_size, step_size, ngram_size, 1, key_filter), workers)
+	with stage("clean_words", len(sentences)):
+		id_lists = [find_shared_words(clean_words(sentence), word_to_int) for sentence in sentences]
+	return id_list_ngram_rows( id_lists, window_size, step_size, ngram_size, key_filter=key_filter )
+
+def document_tokens(text_file, workers=1):
+	'''Read in a path and return a dictionary holding the sorted vocabulary of clean words in that file, the vocabulary id of each clean word in reading order, the offset at which each sentence's ids begin, and the character span of each sentence'''
+	file_contents = read_file(text_file)
+	spans         = sentence_spans(file_contents)
+	cleaned       = clean_sentences( [file_contents[start:end] for start, end in spans.tolist()], workers )
+	
+	vocabulary = sorted( set(w for words in cleaned for w in words) )
+	word_to_id = dict( (w, i) for i, w in enumerate(vocabulary) )
+	return {
+		"vocabulary":       np.array(vocabulary, dtype=np.unicode_),
+		"token_ids":        np.array([word_to_id[w] for words in cleaned for w in words], dtype=np.int32),
+		"sentence_offsets": np.cumsum([0] + [len(words) for words in cleaned]).astype(np.int64),
+		"sentence_spans":   spans
+	}
+
+def document_sentences(text_file, tokens):
+	'''Read in a path and its document_tokens(), and return the list of sentences in that file, cut at the recorded spans rather than split again'''
+	file_contents = read_file(text_file)
+	return [file_contents[start:end] for start, end in tokens["sentence_spans"].tolist()]
+
+def token_id_lists(tokens, word_to_int):
+	'''Read in a document_tokens() dictionary and a word-to-integer mapping, and return a list holding the mapped ids of each sentence's words that are found in the mapping'''
+	return sentence_id_lists( shared_token_ids(tokens, word_to_int), tokens["sentence_offsets"] )
+
+def shared_token_ids(tokens, word_to_int):
+	'''Read in a document_tokens() dictionary and a word-to-integer mapping, and return the mapped id of every token in reading order, or -1 for tokens missing from the mapping'''
+	lookup = np.array([word_to_int.get(w, -1) for w in tokens["vocabulary"].tolist()], dtype=np.int64)
+	return lookup[ tokens["token_ids"] ]
+
+def sentence_id_lists(shared_ids, offsets):
+	'''Read in the shared_token_ids() of a document and the offsets at which a run of consecutive sentences begin (followed by the end of the last), and return a list holding the ids found in the mapping of each of those sentences'''
+	id_lists = []
+	for sentence_id in xrange(len(offsets) - 1):
+		sentence_ids = shared_ids[ offsets[sentence_id]:offsets[sentence_id + 1] ]
+		id_lists.append( sentence_ids[sentence_ids >= 0].tolist() )
+	return id_lists
+
+def generate_packed_ngrams(tokens, word_to_int, window_size, step_size, ngram_size, workers=1, key_filter=None):
+	'''Read in a document_tokens() dictionary and a word-to-integer mapping, and return (keys, sentence_ids) arrays in which each row records one packed ngram and the sentence it occurs in, keeping only the ngrams an optional key filter may hold'''
+	ngram_rows, sentence_ids = id_list_ngram_rows( token_id_lists(tokens, word_to_int), window_size, step_size, ngram_size, workers, key_filter )
+	with stage("pack_ngrams", len(sentence_ids)):
+		return sort_postings(pack_ngrams(ngram_rows, id_bits(len(word_to_int))), sentence_ids)
+
+def expand_blocks(starts_one, lengths_one, starts_two, lengths_two):
+	'''Read in the starts and lengths of paired runs of rows and return two aligned arrays of row indices that enumerate the cross product of each pair of runs'''
+	block_sizes = lengths_one * lengths_two
+	block       = np.repeat(np.arange(len(block_sizes)), block_sizes)
+	offset      = np.arange(block_sizes.sum()) - np.repeat(np.cumsum(block_sizes) - block_sizes, block_sizes)
+	rows_one    = starts_one[block] + offset // lengths_two[block]
+	rows_two    = starts_two[block] + offset % lengths_two[block]
+	return rows_one, rows_two
+
+def pair_shared_postings(keys_one, keys_two):
+	'''Read in two sorted key arrays and return two aligned arrays of row indices, one pair of rows for every combination of rows that hold the same key'''
+	unique_one, starts_one, lengths_one = np.unique(keys_one, return_index=True, return_counts=True)
+	unique_two, starts_two, lengths_two = np.unique(keys_two, return_index=True, return_counts=True)
+	shared     = np.intersect1d(unique_one, unique_two, assume_unique=True)
+	shared_one = np.searchsorted(unique_one, shared)
+	shared_two = np.searchsorted(unique_two, shared)
+	
+	# Each shared key contributes the cross product of its two runs of rows
+	return expand_blocks(starts_one[shared_one], lengths_one[shared_one], starts_two[shared_two], lengths_two[shared_two])
+
+def max_key_multiplicity(keys, sentence_ids):
+	'''Read in sorted (keys, sentence_ids) postings and return the unique keys along with the largest number of times any one sentence holds each key'''
+	if not len(keys):
+		return keys, np.zeros(0, dtype=np.int64)
+	
+	# Postings are sorted by key and then by sentence id, so the rows of each (key, sentence) pair are adjacent
+	run_start     = np.ones(len(keys), dtype=bool)
+	run_start[1:] = (keys[1:] != keys[:-1]) | (sentence_ids[1:] != sentence_ids[:-1])
+	run_starts    = np.flatnonzero(run_start)
+	run_lengths   = np.diff( np.append(run_starts, len(keys)) )
+	unique_keys, key_starts = np.unique(keys[run_starts], return_index=True)
+	return unique_keys, np.maximum.reduceat(run_lengths, key_starts)
+
+def prune_postings(postings_list, threshold):
+	'''Read in a list of two (keys, sentence_ids) postings and a threshold, and return both postings without the rows of sentences that cannot share more than `threshold` ngrams with any sentence of the other text'''
+	pruned = list(postings_list)
+	with stage("prune_postings", len(pruned[0][0]) + len(pruned[1][0])):
+		for this, other in [(0, 1), (1, 0)]:
+			keys, sentence_ids = pruned[this]
+		
+			# A sentence shares at most (its copies of the key) x (the most copies any other sentence holds) of each key
+			other_keys, multiplicity = max_key_multiplicity(*pruned[other])
+			positions, found = find_keys(other_keys, keys)
+			weights          = np.zeros(len(keys))
+			weights[found]   = multiplicity[ positions[found] ]
+			bounds           = np.bincount(sentence_ids, weights=weights) if len(keys) else weights
+			keep             = bounds[sentence_ids] > threshold
+			pruned[this]     = ( keys[keep], sentence_ids[keep] )
+	return pruned
+
+def select_matches(rows, columns, counts, threshold=None, top_k=None):
+	'''Read in aligned arrays of sentence ids from text one and text two and their shared ngram counts, sorted by sentence pair, and return the same arrays restricted to the pairs that share more than `threshold` ngrams and, if `top_k` is given, to the `top_k` highest counts of each sentence of text one'''
+	if threshold is not None:
+		keep = counts > threshold
+		rows, columns, counts = rows[keep], columns[keep], counts[keep]
+	
+	if top_k is not None:
+		# Rank the pairs of each sentence by descending count, breaking ties in favour of the earlier sentence of text two
+		order  = np.lexsort( (columns, -counts.astype(np.int64), rows) )
+		ranked = rows[order]
+		rank   = np.arange(len(order)) - np.searchsorted(ranked, ranked)
+		keep   = np.sort( order[rank < top_k] )
+		rows, columns, counts = rows[keep], columns[keep], counts[keep]
+	return rows, columns, counts
+
+def select_sentence_pairs(sentence_pairs, threshold=None, top_k=None):
+	'''Read in (sentence_id_one, sentence_id_two, count) triples sorted by sentence pair, and return the triples that select_matches() keeps'''
+	columns = [ np.array(column, dtype=np.int64) for column in zip(*sentence_pairs) ] or [ np.zeros(0, dtype=np.int64) ] * 3
+	return zip( *[column.tolist() for column in select_matches(columns[0], columns[1], columns[2], threshold, top_k)] )
+
+def iter_packed_sentence_matches(postings_list, block_rows=4096, threshold=None, top_k=None):
+	'''Read in a list of two (keys, sentence_ids) postings, and yield the (sentence_id_one, sentence_id_two, count) triples of every sentence pair that shares an ngram (and, if given, more than `threshold` ngrams and a place in the `top_k` of its sentence of text one) in sentence pair order, counting `block_rows` sentences of text one at a time and yielding each block as soon as it is counted'''
+	if threshold is not None:
+		postings_list = prune_postings(postings_list, threshold)
+	(keys_one, sentence_ids_one), (keys_two, sentence_ids_two) = postings_list
+	unique_two, starts_two, lengths_two = np.unique(keys_two, return_index=True, return_counts=True)
+	file_two_length = int(sentence_ids_two.max()) + 1 if len(sentence_ids_two) else 1
+	
+	# Group the rows of text one by sentence, so that each block of sentences is one slice of rows
+	order = np.argsort(sentence_ids_one, kind="mergesort")
+	keys_one, sentence_ids_one = keys_one[order], sentence_ids_one[order]
+	file_one_length = int(sentence_ids_one[-1]) + 1 if len(sentence_ids_one) else 0
+	
+	for block_start in xrange(0, file_one_length, block_rows):
+		with stage("count_sentence_matches") as counting:
+			start, stop      = np.searchsorted(sentence_ids_one, [block_start, block_start + block_rows])
+			block_keys, block_ids = sort_postings(keys_one[start:stop], sentence_ids_one[start:stop])
+			unique_one, starts_one, lengths_one = np.unique(block_keys, return_index=True, return_counts=True)
+			positions, found = find_keys(unique_two, unique_one)
+			rows_one, rows_two = expand_blocks(starts_one[found], lengths_one[found], starts_two[ positions[found] ], lengths_two[ positions[found] ])
+			
+			pair_codes       = block_ids[rows_one].astype(np.int64) * file_two_length + sentence_ids_two[rows_two]
+			pair_codes, counts = np.unique(pair_codes, return_counts=True)
+			selected = select_matches( pair_codes // file_two_length, pair_codes % file_two_length, counts, threshold, top_k )
+			counting.items = len(selected[0])
+		
+		for sentence_pair in zip( *[column.tolist() for column in selected] ):
+			yield sentence_pair
+
+def count_packed_sentence_matches(postings_list, threshold=None, top_k=None):
+	'''Read in a list of two (keys, sentence_ids) postings and return the list of iter_packed_sentence_matches() triples'''
+	return list( iter_packed_sentence_matches(postings_list, threshold=threshold, top_k=top_k) )
+
+#########################
+# Sparse Matrix Methods #
+#########################
+
+def incidence_matrices(postings_one, postings_two):
+	'''Read in two (keys, sentence_ids) postings and return a sparse sentence x ngram incidence matrix (CSR) for each, with one column per ngram the two texts share'''
+	shared   = np.intersect1d(postings_one[0], postings_two[0])
+	matrices = []
+	
+	for keys, sentence_ids in [postings_one, postings_two]:
+		columns, found = find_keys(shared, keys)
+		rows    = int(sentence_ids.max()) + 1 if len(sentence_ids) else 0
+		matrices.append( csr_matrix( (np.ones(found.sum(), dtype=np.int32), (sentence_ids[found], columns[found])), shape=(rows, len(shared)) ) )
+	return matrices
+
+def multiply_row_block(arguments):
+	'''Read in the (start, stop) bounds of a block of rows along with a threshold and top-k (either may be None), and return the sorted row, column and value arrays of the select_matches() entries of that block of A * B^T'''
+	start, stop, threshold, top_k = arguments
+	with stage("multiply_row_block", stop - start):
+		a, b_transposed = sparse_operands
+		block = (a[start:stop] * b_transposed).tocoo()
+		order = np.lexsort( (block.col, block.row) )
+		
+		# Each block holds every column of its rows, so the threshold and top-k of those rows can be applied before the block leaves the worker
+		return select_matches( block.row[order] + start, block.col[order], block.data[order], threshold, top_k )
+
+def iter_sparse_sentence_matches(postings_list, block_rows=4096, workers=1, threshold=None, top_k=None):
+	'''Read in a list of two (keys, sentence_ids) postings, and yield the same triples as count_packed_sentence_matches(), computed as the sparse product of the two incidence matrices one block of rows at a time and yielded as each block finishes'''
+	global sparse_operands
+	if threshold is not None:
+		postings_list = prune_postings(postings_list, threshold)
+	with stage("incidence_matrices"):
+		a, b = incidence_matrices(*postings_list)
+	
+	# Worker processes inherit the operands when the pool forks, so only the block bounds and the results are pickled
+	sparse_operands = ( a, b.T.tocsr() )
+	blocks = [ (start, min(start + block_rows, a.shape[0]), threshold, top_k) for start in xrange(0, a.shape[0], block_rows) ]
+	if workers > 1 and len(blocks) > 1:
+		results = imap_sentence_chunks(multiply_row_block, blocks, workers)
+	else:
+		results = (multiply_row_block(arguments) for arguments in blocks)
+	
+	for rows, columns, counts in results:
+		for sentence_pair in zip(rows.tolist(), columns.tolist(), counts.tolist()):
+			yield sentence_pair
+
+def count_sparse_sentence_matches(postings_list, block_rows=4096, workers=1, threshold=None, top_k=None):
+	'''Read in a list of two (keys, sentence_ids) postings and return the list of iter_sparse_sentence_matches() triples'''
+	return list( iter_sparse_sentence_matches(postings_list, block_rows, workers, threshold, top_k) )
+
+###################
+# MinHash Methods #
+###################
+
+def minhash_candidate_codes(id_lists_one, id_lists_two, num_permutations, bands):
+	'''Read in the shared word ids of each sentence in two texts, and return the sorted codes (sentence_id_one * len(id_lists_two) + sentence_id_two) of the sentence pairs whose MinHash signatures agree on at least one band'''
+	sentence_ids_one, signatures_one = minhash_signatures(id_lists_one, num_permutations)
+	sentence_ids_two, signatures_two = minhash_signatures(id_lists_two, num_permutations)
+	keys_one = band_keys(signatures_one, bands)
+	keys_two = band_keys(signatures_two, bands)
+	codes    = [ np.zeros(0, dtype=np.int64) ]
+	
+	# Sentences whose band hashes agree land in the same bucket; pair the sentences of text one and text two that share a bucket
+	for band in xrange(keys_one.shape[1]):
+		band_one, bucket_one = sort_postings(keys_one[:, band], sentence_ids_one)
+		band_two, bucket_two = sort_postings(keys_two[:, band], sentence_ids_two)
+		rows_one, rows_two   = pair_shared_postings(band_one, band_two)
+		codes.append( bucket_one[rows_one] * len(id_lists_two) + bucket_two[rows_two] )
+	return np.unique( np.concatenate(codes) )
+
+def count_minhash_sentence_matches(id_lists_one, id_lists_two, bits, window_size, step_size, ngram_size, num_permutations=64, bands=32, workers=1):
+	'''Read in the shared word ids of each sentence in two texts, the number of bits per id, the combinatorial parameters, and the MinHash signature length and band count, and return the count_packed_sentence_matches() triples of the candidate pairs found by LSH'''
+	with stage("minhash_candidates") as hashing:
+		candidates    = minhash_candidate_codes(id_lists_one, id_lists_two, num_permutations, bands)
+		hashing.items = len(candidates)
+	file_two_length = len(id_lists_two)
+	postings        = []
+	
+	# Only sentences that belong to some candidate pair need their ngrams generated
+	for id_lists, candidate_ids in [ (id_lists_one, candidates // file_two_length), (id_lists_two, candidates % file_two_length) ]:
+		candidate_ids = set(candidate_ids.tolist())
+		id_lists      = [ids if sentence_id in candidate_ids else [] for sentence_id, ids in enumerate(id_lists)]
+		ngram_rows, sentence_ids = id_list_ngram_rows(id_lists, window_size, step_size, ngram_size, workers)
+		postings.append( sort_postings(pack_ngrams(ngram_rows, bits), sentence_ids) )
+	
+	candidates = set(candidates.tolist())
+	return [pair for pair in count_packed_sentence_matches(postings) if pair[0] * file_two_length + pair[1] in candidates]
+
+def pair_recall(reference_pairs, found_pairs):
+	'''Read in two lists of (sentence_id_one, sentence_id_two, count) triples and return the share of the reference sentence pairs that were also found, along with the number found and the number of reference pairs'''
+	reference = set( (pair[0], pair[1]) for pair in reference_pairs )
+	found     = len( reference & set((pair[0], pair[1]) for pair in found_pairs) )
+	return (found / len(reference) if reference else 1.0), found, len(reference)
+
+#########################
+# External Sort Methods #
+#########################
+
+def iter_file_pieces(text_file, piece_bytes=1 << 20):
+	'''Read in a path and yield (byte offset, bytes) pieces of the file in order, reading about `piece_bytes` bytes at a time; every piece but the last ends in ASCII whitespace, so no token is cut in two and each piece decodes on its own'''
+	with open(text_file, "rb") as f:
+		position = 0
+		carry    = b""
+		for data in iter(lambda: f.read(piece_bytes), b""):
+			data = carry + data
+			cut  = max( data.rfind(c) for c in WHITESPACE_BYTES ) + 1
+			if cut:
+				yield position, data[:cut]
+				position += cut
+				carry     = data[cut:]
+			else:
+				carry = data
+		if carry:
+			yield position, carry
+
+def anchored_byte_offsets(text, anchors, anchor_bytes, positions, before=0):
+	'''Read in a string, the sorted positions in it of the start of each of its tokens, the byte offset of each of those starts in a file, and a list of positions, and return the byte offset in the file of each position, counted from the last token start at or before that position minus `before`'''
+	tokens = np.searchsorted(anchors, np.asarray(positions, dtype=np.int64) - before, side="right") - 1
+	return [ int(anchor_bytes[token]) + len( text[anchors[token]:position].encode("utf-8") ) for token, position in zip(tokens.tolist(), positions) ]
+
+def stream_sentence_spans(text_file, block_chars=1 << 20):
+	'''Read in a path and return the sentence_spans() of its read_file() text along with the (start, end) byte offsets of the same sentences in the file, splitting about `block_chars` characters at a time rather than the whole file at once'''
+	char_spans   = [ np.zeros((0, 2), dtype=np.int64) ]
+	byte_spans   = [ np.zeros((0, 2), dtype=np.int64) ]
+	text         = u""
+	text_start   = 0
+	anchors      = np.zeros(0, dtype=np.int64)
+	anchor_bytes = np.zeros(0, dtype=np.int64)
+	
+	for piece in chain( iter_file_pieces(text_file), [None] ):
+		if piece is not None:
+			piece_start, data = piece
+			piece_text        = data.decode("utf-8")
+			tokens, starts    = token_starts(piece_text)
+			if not tokens:
+				continue
+			
+			# Join the tokens with single spaces, as read_file() does, and note where each starts in the text and in the file
+			if text:
+				text += u" "
+			anchors      = np.append( anchors, len(text) + np.cumsum([0] + [len(token) + 1 for token in tokens[:-1]]) )
+			anchor_bytes = np.append( anchor_bytes, piece_start + utf8_offsets(piece_text)[starts] )
+			text        += u" ".join(tokens)
+			if len(text) < block_chars:
+				continue
+		if not text:
+			continue
+		
+		# Until the file has ended, the tokenizer cannot tell how the last token ends a sentence without the token after it, so the
+		# sentence that token starts in waits to be split again with the next piece
+		spans = sentence_spans(text)
+		if piece is not None:
+			waiting = int( np.searchsorted(spans[:, 0], anchors[-1], side="right") ) - 1
+			if waiting < 1:
+				continue
+			rest  = int(spans[waiting, 0])
+			spans = spans[:waiting]
+		
+		starts = anchored_byte_offsets( text, anchors, anchor_bytes, spans[:, 0].tolist() )
+		ends   = anchored_byte_offsets( text, anchors, anchor_bytes, spans[:, 1].tolist(), before=1 )
+		char_spans.append( spans + text_start )
+		byte_spans.append( np.column_stack((starts, ends)).astype(np.int64) )
+		
+		if piece is not None:
+			keep         = anchors > rest
+			anchor_bytes = np.append( anchored_byte_offsets(text, anchors, anchor_bytes, [rest]), anchor_bytes[keep] )
+			anchors      = np.append( 0, anchors[keep] - rest )
+			text         = text[rest:]
+			text_start  += rest
+	return np.concatenate(char_spans), np.concatenate(byte_spans)
+
+def write_document_tokens(text_file, byte_spans, token_path, block_sentences=4096, workers=1):
+	'''Read in a path, the byte spans of its sentences and the path of a file to write, clean `block_sentences` sentences at a time, and write the vocabulary id of each clean word in reading order to that file as int32; return the vocabulary as a dictionary from each word to its id, along with the offset at which each sentence's ids begin (followed by the end of the last)'''
+	sentences  = DocumentSentences(text_file, byte_spans)
+	vocabulary = {}
+	offsets    = np.zeros(len(byte_spans) + 1, dtype=np.int64)
+	with open(token_path, "wb") as out:
+		for start in xrange(0, len(byte_spans), block_sentences):
+			cleaned = clean_sentences( [sentences[i] for i in xrange(start, min(start + block_sentences, len(byte_spans)))], workers )
+			np.array( [vocabulary.setdefault(w, len(vocabulary)) for words in cleaned for w in words], dtype=np.int32 ).tofile(out)
+			offsets[start + 1:start + 1 + len(cleaned)] = offsets[start] + np.cumsum([len(words) for words in cleaned])
+	sentences.close()
+	return vocabulary, offsets
+
+def iter_packed_ngram_blocks(token_ids, offsets, lookup, bits, window_size, step_size, ngram_size, block_sentences=4096):
+	'''Read in the vocabulary ids of a text's words in reading order, the offset at which each sentence's ids begin (followed by the end of the last), an array giving the shared word id of each vocabulary id (-1 for words the other text lacks), the number of bits per shared id and the combinatorial parameters, and yield the (keys, sentence_ids) of the packed ngrams of `block_sentences` sentences at a time'''
+	for start in xrange(0, len(offsets) - 1, block_sentences):
+		block_offsets = offsets[start:start + block_sentences + 1]
+		shared_ids    = lookup[ token_ids[block_offsets[0]:block_offsets[-1]] ]
+		ngram_rows, sentence_ids = id_list_ngram_rows( sentence_id_lists(shared_ids, block_offsets - block_offsets[0]), window_size, step_size, ngram_size )
+		yield pack_ngrams(ngram_rows, bits), sentence_ids + np.uint32(start)
+
+def ngram_record_dtype(bits, ngram_size):
+	'''Read in the number of bits per word id and the number of ids per ngram, and return the dtype of the (key, doc, sentence) records of an ngram run file'''
+	key_dtype = np.uint64 if ngram_size * bits <= 64 else np.dtype( (np.void, ngram_size * 4) )
+	return np.dtype( [("key", key_dtype), ("doc", np.uint8), ("sentence", np.uint32)] )
+
+def ngram_records(keys, sentence_ids, document_id, record_dtype):
+	'''Read in aligned arrays of packed keys and sentence ids, the number of the document they come from and the record dtype, and return them as an array of (key, doc, sentence) records'''
+	records = np.zeros(len(keys), dtype=record_dtype)
+	records["key"]      = keys
+	records["doc"]      = document_id
+	records["sentence"] = sentence_ids
+	return records
+
+def joined_pair_records(merged_chunks, file_two_length):
+	'''Read in merged chunks of ngram records holding complete key groups and the number of sentences in text two, and yield for each chunk the (key, count) records of the sentence pairs its keys join, keyed by sentence_one * file_two_length + sentence_two'''
+	for records in merged_chunks:
+		one = records[ records["doc"] == 0 ]
+		two = records[ records["doc"] == 1 ]
+		rows_one, rows_two = pair_shared_postings( one["key"], two["key"] )
+		pair_codes, counts = np.unique( one["sentence"][rows_one].astype(np.uint64) * np.uint64(file_two_length) + two["sentence"][rows_two], return_counts=True )
+		pairs = np.zeros( len(pair_codes), dtype=PAIR_RECORD_DTYPE )
+		pairs["key"]   = pair_codes
+		pairs["count"] = counts
+		yield pairs
+
+def sum_pair_counts(pairs):
+	'''Read in (key, count) pair records sorted by key and return one record per key holding the sum of its counts'''
+	if not len(pairs):
+		return pairs
+	starts = np.flatnonzero( np.append(True, pairs["key"][1:] != pairs["key"][:-1]) )
+	summed = np.zeros( len(starts), dtype=PAIR_RECORD_DTYPE )
+	summed["key"]   = pairs["key"][starts]
+	summed["count"] = np.add.reduceat(pairs["count"], starts)
+	return summed
+
+def budget_records(memory_budget, record_dtype):
+	'''Read in a memory budget in megabytes and a record dtype, and return the number of records to hold at a time; sorting takes the records, their sorted copy and the sort order, so the records are kept to a quarter of the budget'''
+	return max( 1, memory_budget * 1024 * 1024 // (4 * record_dtype.itemsize) )
+
+def iter_external_sentence_matches(documents, window_size, step_size, ngram_size, memory_budget=1024, temp_dir=None, threshold=None, top_k=None):
+	'''Read in the (vocabulary, offsets, token_path) of two texts written by write_document_tokens(), the combinatorial parameters, a memory budget in megabytes and a temporary directory, and yield the iter_packed_sentence_matches() triples of the two texts, sorted on disk'''
+	file_two_length = len(documents[1][1]) - 1
+	
+	run_dir         = mkdtemp(prefix="reuse-runs-", dir=temp_dir)
+	try:
+		word_to_int  = integerize_words( set(documents[0][0]) & set(documents[1][0]) )
+		bits         = id_bits(len(word_to_int))
+		record_dtype = ngram_record_dtype(bits, ngram_size)
+		
+		with stage("write_ngram_runs"):
+			ngram_runs = []
+			for document_id, (vocabulary, offsets, token_path) in enumerate(documents):
+				lookup = np.full(len(vocabulary), -1, dtype=np.int64)
+				for w, i in vocabulary.iteritems():
+					lookup[i] = word_to_int.get(w, -1)
+				token_ids = np.memmap(token_path, dtype=np.int32, mode="r") if offsets[-1] else np.zeros(0, dtype=np.int32)
+				blocks = ( ngram_records(keys, sentence_ids, document_id, record_dtype) for keys, sentence_ids in iter_packed_ngram_blocks(token_ids, offsets, lookup, bits, window_size, step_size, ngram_size) )
+				ngram_runs.extend( write_runs(blocks, run_dir, "ngrams-" + str(document_id), budget_records(memory_budget, record_dtype)) )
+				del token_ids
 		
+		with stage("join_ngram_runs"):
+			merged    = merge_runs( ngram_runs, budget_records(memory_budget, record_dtype) )
+			pair_runs = write_runs( joined_pair_records(merged, file_two_length), run_dir, "pairs", budget_records(memory_budget, PAIR_RECORD_DTYPE), sum_pair_counts )
+		
+		# A sentence of text one may have pairs in two consecutive chunks, so the pairs of the last sentence of each chunk wait for the next
+		waiting = np.zeros(0, dtype=PAIR_RECORD_DTYPE)
+		for pairs in chain( merge_runs(pair_runs, budget_records(memory_budget, PAIR_RECORD_DTYPE)), [None] ):
+			with stage("count_sentence_matches") as counting:
+				if pairs is None:
+					pairs, waiting = waiting, waiting[:0]
+				else:
+					pairs = np.concatenate( (waiting, sum_pair_counts(pairs)) )
+					rows  = pairs["key"] // np.uint64(file_two_length)
+					split = int( np.searchsorted(rows, rows[-1]) )
+					pairs, waiting = pairs[:split], pairs[split:]
+				
+				selected = select_matches( (pairs["key"] // np.uint64(file_two_length)).astype(np.int64), (pairs["key"] % np.uint64(file_two_length)).astype(np.int64), pairs["count"].astype(np.int64), threshold, top_k )
+				counting.items = len(selected[0])
+			for triple in zip( *[column.tolist() for column in selected] ):
+				yield triple
+	finally:
+		rmtree(run_dir)
+
+####################
+# Parallel Methods #
+####################
+
+def chunk_sentences(sentences, workers):
+	'''Read in a list of sentences and a number of workers, and return consecutive slices of that list, about four per worker so that slow slices even out'''
+	chunk_size = max(1, int(math.ceil(len(sentences) / (workers * 4))))
+	return [sentences[i:i + chunk_size] for i in xrange(0, len(sentences), chunk_size)]
+
+def imap_sentence_chunks(function, arguments, workers):
+	'''Read in a function, a list of argument tuples, and a number of workers, and yield the function's results for each tuple, in order, as a process pool computes them'''
+	# Load the resources before forking so that every worker inherits them instead of loading its own copy
+	load_resources()
+	pool = Pool(workers)
+	try:
+		for result in pool.imap(function, arguments):
+			yield result
+	finally:
+		pool.close()
+		pool.join()
+
+def map_sentence_chunks(function, arguments, workers):
+	'''Read in a function, a list of argument tuples, and a number of workers, and return the function's results for each tuple, in order, computed in a process pool'''
+	return list( imap_sentence_chunks(function, arguments, workers) )
+
+def clean_sentence_words(sentences):
+	'''Read in a list of sentences and return the set of clean words they contain'''
+	words = set()
+	for sentence in sentences:
+		words.update( clean_words(sentence) )
+	return words
+
+def clean_sentences(sentences, workers=1):
+	'''Read in a list of sentences and return the clean_words() of each, cleaning chunks of sentences in `workers` processes if more than one is requested'''
+	with stage("clean_words", len(sentences)):
+		if workers > 1 and len(sentences) > 1:
+			return [words for chunk in map_sentence_chunks(clean_sentence_list, chunk_sentences(sentences, workers), workers) for words in chunk]
+		return clean_sentence_list(sentences)
+
+def clean_sentence_list(sentences):
+	'''Read in a list of sentences and return a list of the clean words in each'''
+	return [clean_words(sentence) for sentence in sentences]
+
+def sentence_ngram_chunk(arguments):
+	'''Read in a tuple of sentence_ngram_rows() arguments and return its result; the process pool calls this with one chunk of sentences at a time'''
+	return sentence_ngram_rows(*arguments)
+
+def id_list_ngram_chunk(arguments):
+	'''Read in a tuple of id_list_ngram_rows() arguments and return its result; the process pool calls this with one chunk of sentences at a time'''
+	return id_list_ngram_rows(*arguments)
+
+def parallel_ngram_rows(chunk_function, sentences, arguments, workers):
+	'''Read in a chunk function, a list of per-sentence items, the remaining arguments of that function, and a number of workers, and return the (ngram_rows, sentence_ids) of every chunk of sentences concatenated in order'''
+	chunks  = chunk_sentences(sentences, workers)
+	results = map_sentence_chunks( chunk_function, [(chunk,) + arguments for chunk in chunks], workers )
+	
+	# Sentence ids restart at zero in every chunk; shift them by the number of sentences in the chunks before it
+	chunk_offsets = np.cumsum([0] + [len(chunk) for chunk in chunks[:-1]])
+	ngram_rows    = np.concatenate([rows for rows, sentence_ids in results])
+	sentence_ids  = np.concatenate([sentence_ids + np.uint32(offset) for (rows, sentence_ids), offset in zip(results, chunk_offsets)])
+	return ngram_rows, sentence_ids
+
+def document_words(text_file, workers=1):
+	'''Read in a path and return the set of clean words in that file, cleaning chunks of sentences in `workers` processes if more than one is requested'''
+	file_contents = read_file(text_file)
+	if workers > 1:
+		chunks = chunk_sentences( sentence_split(file_contents), workers )
+		with stage("clean_words", sum(len(chunk) for chunk in chunks)):
+			return set().union( *map_sentence_chunks(clean_sentence_words, chunks, workers) )
+	with stage("clean_words"):
+		return set( clean_words(file_contents) )
+
+#################
+# Cache Methods #
+#################
+
+def open_cache(cache_dir, cache_size):
+	'''Read in a cache directory and a size cap in megabytes, and return a dictionary describing that cache, or None if no directory was given'''
+	if cache_dir is None:
+		return None
+	resource_digests = [file_digest(resource_path) for resource_path in resource_files()]
+	return {
+		"dir":       cache_dir,
+		"max_bytes": cache_size * 1024 * 1024,
+		"resources": cache_key(nltk_version, *resource_digests),
+		"digests":   {}
+	}
+
+def cached_file_digest(cache, text_file):
+	'''Read in a cache and a path and return the digest of that file's contents, hashing each file at most once per run'''
+	if text_file not in cache["digests"]:
+		cache["digests"][text_file] = file_digest(text_file)
+	return cache["digests"][text_file]
+
+def cached_document_tokens(text_file, cache, workers=1):
+	'''Read in a path and a cache (or None), and return the document_tokens() of that file, reusing a cached copy when the file's contents and the cleaning resources are unchanged'''
+	if cache is None:
+		return document_tokens(text_file, workers)
+	
+	key    = cache_key( "tokens", cached_file_digest(cache, text_file), cache["resources"] )
+	tokens = load_entry(cache["dir"], key)
+	if tokens is None:
+		tokens = document_tokens(text_file, workers)
+		store_entry(cache["dir"], key, tokens, cache["max_bytes"])
+	return tokens
+
 ################
 # Main Methods #
 ################		
 
-def generate_ngrams(text_file):
-	'''Read in a string, lowercase, strip punctuation, remove duplicates, standardize spelling, then lemmatize each word, and return a tuple of words'''
-	ngram_to_sentence_id = defaultdict(list)
-	ngram_to_sentence_id["file_path"].append(text_file)
-	
+def generate_ngrams(text_file, word_to_int, window_size, step_size, ngram_size, workers=1, key_filter=None):
+	'''Read in a path, a word-to-integer mapping and the combinatorial parameters, split and clean the file's sentences, and return the NgramPostings of the packed ngrams in those sentences, keeping only the ngrams an optional key filter may hold'''
 	file_contents = read_file(text_file)
-	
-	for sentence_id, sentence in enumerate( sentence_split(file_contents) ):
-		word_list    = clean_words(sentence)
-		shared_words = find_shared_words(word_list)
-		ngram_iterable = word_combinations(shared_words)
-		if ngram_iterable:
-			for ngram in ngram_iterable:
-				ngram_to_sentence_id[".".join(str(i) for i in ngram)].append(sentence_id)
-	return ngram_to_sentence_id	
+	ngram_rows, sentence_ids = sentence_ngram_rows( sentence_split(file_contents), word_to_int, window_size, step_size, ngram_size, workers, key_filter )
+	with stage("pack_ngrams", len(sentence_ids)):
+		return NgramPostings( pack_ngrams(ngram_rows, id_bits(len(word_to_int))), sentence_ids )
 
 def count_sentence_matches(results_list):
-	'''Read in a list of two autovivify objects and return a Counter object that indicates the number of ngrams shared by sentence pairs in the input documents'''
-	matching_ngrams_counter = Counter()
-	intersection = set(results_list[0].keys()) & set(results_list[1].keys())
-		
-	# Given a common ngram, find all sentences that ngram appears within, and increase the match count for that sentence combination'''
-	for ngram in intersection:
-		for sentence_id_one in results_list[0][ngram]:
-			for sentence_id_two in results_list[1][ngram]:
-				matching_ngrams_counter[ str(sentence_id_one) + "." + str(sentence_id_two) ] += 1 
-							
-	return matching_ngrams_counter
-	
-def write_significant_matches(matching_ngrams_counter):
-	'''Read in a Counter object indicating the sentences from the two files that share ngrams, and write those paired sentences to disk'''
-	file_one_path      = results[0]["file_path"][0]
-	file_two_path      = results[1]["file_path"][0]
-	file_one_sentences = sentence_split( read_file(file_one_path) )
-	file_two_sentences = sentence_split( read_file(file_two_path) )
-	
-	with codecs.open("matches.txt",'w','utf-8') as out:
-		for sentence_pair in matching_ngrams_counter:
+	'''Read in the NgramPostings of two documents and return a Counter object that indicates the number of ngrams shared by sentence pairs in the input documents'''
+	with stage("count_sentence_matches") as counting:
+		matching_ngrams_counter = Counter()
+		postings_one, postings_two = results_list
+		
+		# Given a common ngram, find all sentences that ngram appears within, and increase the match count for that sentence combination
+		for position_one, position_two in zip( *postings_one.intersect(postings_two) ):
+			sentence_ids_two = postings_two.run(position_two).tolist()
+			for sentence_id_one in postings_one.run(position_one).tolist():
+				for sentence_id_two in sentence_ids_two:
+					matching_ngrams_counter[ str(sentence_id_one) + "." + str(sentence_id_two) ] += 1
+		
+		counting.items = len(matching_ngrams_counter)
+		return matching_ngrams_counter
+
+def counter_to_sentence_pairs(matching_ngrams_counter):
+	'''Read in a Counter object keyed by "sentence_id_one.sentence_id_two" and return its (sentence_id_one, sentence_id_two, count) triples sorted by sentence pair'''
+	sentence_pairs = []
+	for sentence_pair, count in matching_ngrams_counter.iteritems():
+		sentence_id_one, sentence_id_two = sentence_pair.split(".")
+		sentence_pairs.append( (int(sentence_id_one), int(sentence_id_two), count) )
+	return sorted(sentence_pairs)
+	
+def match_lines(sentence_pairs, file_one_path, file_two_path, sentences, threshold=5):
+	'''Read in an iterable of (sentence_id_one, sentence_id_two, count) triples, the paths of the two files and their lists of sentences, and yield the matches.txt line of each pair that shares more than `threshold` ngrams'''
+	file_one_sentences, file_two_sentences = sentences
+	for sentence_id_one, sentence_id_two, count in sentence_pairs:
+		
+		# Raising the integer value below increases precision; lowering it increases recall
+		if count > threshold:
+			sentence_one = file_one_sentences[ sentence_id_one ]
+			sentence_two = file_two_sentences[ sentence_id_two ]
 			
-			# Raising the integer value below increases precision; lowering it increases recall
-			if matching_ngrams_counter[sentence_pair] > 5:
-				sentence_one = file_one_sentences[ int(sentence_pair.split(".")[0]) ]
-				sentence_two = file_two_sentences[ int(sentence_pair.split(".")[1]) ]
-				
-				out.write( 
-					file_one_path + "\t" +
-					file_two_path + "\t" +
-					unicode(matching_ngrams_counter[sentence_pair]) + "\t" + 
-					sentence_one + "\t" +
-					sentence_two + "\n" 
-					)
+			yield ( 
+				file_one_path + "\t" +
+				file_two_path + "\t" +
+				unicode(count) + "\t" + 
+				sentence_one + "\t" +
+				sentence_two + "\n" 
+				)
+
+def write_significant_matches(sentence_pairs, file_one_path, file_two_path, threshold=5, sentences=None):
+	'''Read in an iterable of (sentence_id_one, sentence_id_two, count) triples indicating the sentences from the two files that share ngrams, and write the paired sentences that share more than `threshold` ngrams to disk as the triples arrive. If the two files' lists of sentences are given they are used instead of splitting the files again'''
+	if sentences is None:
+		sentences = [ sentence_split(read_file(file_path)) for file_path in [file_one_path, file_two_path] ]
+	
+	with stage("write", 0) as writing, codecs.open("matches.txt",'w','utf-8') as out:
+		for line in match_lines(sentence_pairs, file_one_path, file_two_path, sentences, threshold):
+			out.write(line)
+			writing.items += 1
+
+def write_match_store(sentence_pairs, file_one_path, file_two_path, byte_spans, threshold=5, store_dir="matches"):
+	'''Read in an iterable of (sentence_id_one, sentence_id_two, count) triples, the paths of the two files and the byte spans of their sentences, and write a binary record of each pair that shares more than `threshold` ngrams to a match store in `store_dir`, replacing any store already there'''
+	with stage("write", 0) as writing:
+		store    = create_store(store_dir)
+		document = [ store.add_document(file_path, file_spans) for file_path, file_spans in zip([file_one_path, file_two_path], byte_spans) ]
+		writing.items = store.append(document[0], document[1], sentence_pairs, threshold)
+
+def parse_arguments():
+	'''Read the command line arguments and return them as a namespace'''
+	parser = argparse.ArgumentParser(description="Find the sentences in two texts that share combinatorial ngrams")
+	parser.add_argument("text_one", help="path to the first text")
+	parser.add_argument("text_two", help="path to the second text")
+	parser.add_argument("window_size", type=int, help="the size of the sliding window to be created")
+	parser.add_argument("step_size", type=int, help="number of words to advance the sliding window when it moves")
+	parser.add_argument("ngram_size", type=int, help="number of words to include in each ngram")
+	parser.add_argument("--threshold", type=int, default=5, help="number of ngrams a sentence pair must share more than to count as a match; raising it increases precision, lowering it increases recall (default 5)")
+	parser.add_argument("--top-k", type=int, help="keep only this many of the best matches of each sentence of text one")
+	parser.add_argument("--engine", choices=ENGINES, default="packed",
+		help="packed (default) stores ngrams as fixed-width integer keys and counts matches with vectorized sorts; strings is the original path, which counts each shared ngram's sentence pairs one at a time in Python; minhash only counts the sentence pairs whose MinHash sketches collide in LSH buckets; sparse multiplies sparse sentence x ngram matrices; external sorts ngrams and sentence pairs on disk within --memory-budget")
+	parser.add_argument("--memory-budget", type=int, default=1024, help="megabytes of ngram and sentence pair records the external engine holds in memory at a time (default 1024)")
+	parser.add_argument("--temp-dir", help="directory in which the external engine writes its sorted run files (default: the system's temporary directory)")
+	parser.add_argument("--minhash-permutations", type=int, default=64, help="number of hash functions in each sentence's MinHash signature (default 64)")
+	parser.add_argument("--minhash-bands", type=int, default=32, help="number of LSH bands the signature is split into; more bands find more candidates (default 32)")
+	parser.add_argument("--block-rows", type=int, default=4096, help="number of sentences of text one the packed and sparse engines count at a time; each block's matches are written as soon as it is counted (default 4096)")
+	parser.add_argument("--report-recall", action="store_true", help="with --engine minhash, also run the exact packed engine and print the share of its matches the minhash engine found")
+	parser.add_argument("--workers", type=int, default=1, help="number of processes used to clean sentences and generate ngrams (default 1)")
+	parser.add_argument("--cache-dir", help="directory in which each text's cleaned tokens are cached between runs")
+	parser.add_argument("--prefilter", choices=PREFILTERS, help="build a Bloom filter (bloom) or a sorted set (exact) of the first text's ngrams, and drop each ngram of the second text that cannot be shared as soon as it is generated, lowering peak memory (packed, sparse and strings engines)")
+	parser.add_argument("--output-format", choices=["tsv", "binary"], default="tsv",
+		help="tsv (default) writes both sentences of every match to matches.txt; binary writes fixed-width match records and the sentence offsets of each text to the matches/ directory, which `python match_store.py to-tsv matches` converts to matches.txt")
+	parser.add_argument("--profile", metavar="REPORT", help="write the wall time, items, throughput and peak memory of each pipeline stage to this JSON file")
+	parser.add_argument("--profile-stage", metavar="STAGE", help="with --profile, also run this stage (e.g. clean_words) under cProfile and write its statistics next to the report with a .prof extension")
+	parser.add_argument("--cache-size", type=int, default=1024, help="size cap of the cache in megabytes; least recently used entries are evicted first (default 1024)")
+	args = parser.parse_args()
+	if args.memory_budget < 1:
+		parser.error("--memory-budget must be at least 1 megabyte")
+	return args
 					
+############
+# Detector #
+############
+
+class ReuseDetector(object):
+	'''Find the sentences that texts share combinatorial ngrams with. The cleaning resources are loaded once, on first use, and
+	reused by every later comparison, so one detector can serve any number of calls from a long-running process'''
+	
+	def __init__(self, window_size=8, step_size=4, ngram_size=4, threshold=5, engine="packed", workers=1, cache_dir=None, cache_size=1024, minhash_permutations=64, minhash_bands=32, block_rows=4096, top_k=None, prefilter=None, memory_budget=1024, temp_dir=None):
+		'''Read in the combinatorial parameters and the options of combinatorial_ngrams.py, and return a detector that has not yet loaded anything'''
+		if engine not in ENGINES:
+			raise ValueError("unknown engine: " + repr(engine) + "; choose one of " + ", ".join(ENGINES))
+		if prefilter is not None and prefilter not in PREFILTERS:
+			raise ValueError("unknown prefilter: " + repr(prefilter) + "; choose one of " + ", ".join(PREFILTERS))
+		if memory_budget < 1:
+			raise ValueError("memory_budget must be at least 1 megabyte")
+		self.window_size = window_size
+		self.step_size   = step_size
+		self.ngram_size  = ngram_size
+		self.threshold   = threshold
+		self.engine      = engine
+		self.workers     = workers
+		self.cache_dir   = cache_dir
+		self.cache_size  = cache_size
+		self.minhash_permutations = minhash_permutations
+		self.minhash_bands        = minhash_bands
+		self.block_rows           = block_rows
+		self.top_k       = top_k
+		self.prefilter   = prefilter
+		self.memory_budget = memory_budget
+		self.temp_dir      = temp_dir
+		self.cache       = None
+		self.documents   = {}
+		self.spans       = {}
+		self.token_files = {}
+		self.token_dir   = None
+	
+	def load_resources(self):
+		'''Load the cleaning resources (and open the cache) now rather than on first use'''
+		load_resources()
+		if self.cache is None:
+			self.cache = open_cache(self.cache_dir, self.cache_size)
+	
+	def tokens(self, text_file):
+		'''Read in a path and return its document_tokens(), reusing the copy kept by index() if there is one'''
+		if text_file not in self.documents:
+			self.load_resources()
+			return cached_document_tokens(text_file, self.cache, self.workers)
+		return self.documents[text_file]
+	
+	def index(self, texts):
+		'''Read in a list of paths, clean each text once, and keep the results so that later comparisons involving those texts skip cleaning. The external engine keeps each text's sentence spans and vocabulary in memory and its word ids in a token file on disk'''
+		for text_file in texts:
+			if self.engine == "external":
+				self.external_tokens(text_file)
+			else:
+				self.documents[text_file] = self.tokens(text_file)
+	
+	def streamed_spans(self, text_file):
+		'''Read in a path and return its stream_sentence_spans(), splitting the file only the first time'''
+		if text_file not in self.spans:
+			self.load_resources()
+			self.spans[text_file] = stream_sentence_spans(text_file)
+		return self.spans[text_file]
+	
+	def external_tokens(self, text_file):
+		'''Read in a path and return the (vocabulary, offsets, token_path) that write_document_tokens() writes for it, cleaning the text only the first time'''
+		if text_file not in self.token_files:
+			if self.token_dir is None:
+				self.token_dir = mkdtemp(prefix="reuse-tokens-", dir=self.temp_dir)
+			token_path = path.join( self.token_dir, str(len(self.token_files)) + ".bin" )
+			vocabulary, offsets = write_document_tokens( text_file, self.sentence_byte_spans(text_file), token_path, workers=self.workers )
+			self.token_files[text_file] = (vocabulary, offsets, token_path)
+		return self.token_files[text_file]
+	
+	def close(self):
+		'''Remove the token files the external engine has written'''
+		if self.token_dir is not None:
+			rmtree(self.token_dir)
+			self.token_dir   = None
+			self.token_files = {}
+	
+	def sentences(self, text_file):
+		'''Read in a path and return the list of its sentences, cut at the spans recorded when the text was cleaned. The external engine returns a DocumentSentences that reads each sentence from disk when it is needed'''
+		if self.engine == "strings":
+			return sentence_split( read_file(text_file) )
+		if self.engine == "external":
+			return DocumentSentences( text_file, self.sentence_byte_spans(text_file) )
+		return document_sentences( text_file, self.tokens(text_file) )
+	
+	def sentence_spans(self, text_file):
+		'''Read in a path and return the (start, end) character spans of its sentences in the read_file() text'''
+		if self.engine == "strings":
+			return sentence_spans( read_file(text_file) )
+		if self.engine == "external":
+			return self.streamed_spans(text_file)[0]
+		return self.tokens(text_file)["sentence_spans"]
+	
+	def sentence_byte_spans(self, text_file):
+		'''Read in a path and return the (start, end) byte offsets of its sentences in the file'''
+		if self.engine == "external":
+			return self.streamed_spans(text_file)[1]
+		return raw_byte_spans( text_file, self.sentence_spans(text_file) )
+	
+	def postings(self, text_a, text_b):
+		'''Read in two paths and return the packed ngram postings of each, with word ids assigned to the words the two texts share. With a prefilter, text_b only keeps the ngrams that text_a may share'''
+		tokens      = [ self.tokens(i) for i in [text_a, text_b] ]
+		word_to_int = integerize_words( set(tokens[0]["vocabulary"].tolist()) & set(tokens[1]["vocabulary"].tolist()) )
+		postings_a  = generate_packed_ngrams(tokens[0], word_to_int, self.window_size, self.step_size, self.ngram_size, self.workers)
+		key_filter  = self.key_filter(postings_a[0], word_to_int)
+		return [ postings_a, generate_packed_ngrams(tokens[1], word_to_int, self.window_size, self.step_size, self.ngram_size, self.workers, key_filter) ]
+	
+	def key_filter(self, keys, word_to_int):
+		'''Read in the packed ngram keys of a text and the word-to-integer mapping they were packed with, and return a filter of the detector's prefilter kind holding those keys, or None if there is no prefilter'''
+		if self.prefilter is None:
+			return None
+		with stage("prefilter", len(keys)):
+			return build_key_filter( self.prefilter, keys, id_bits(len(word_to_int)) )
+	
+	def count_matches(self, text_a, text_b):
+		'''Read in two paths and return the (sentence_id_a, sentence_id_b, count) triples of every sentence pair that shares ngrams, sorted by sentence pair'''
+		self.load_resources()
+		infiles = [ text_a, text_b ]
+		
+		if self.engine == "strings":
+			word_to_int = integerize_words( document_words(text_a, self.workers) & document_words(text_b, self.workers) )
+			postings_a  = generate_ngrams(text_a, word_to_int, self.window_size, self.step_size, self.ngram_size, self.workers)
+			postings_b  = generate_ngrams(text_b, word_to_int, self.window_size, self.step_size, self.ngram_size, self.workers, self.key_filter(postings_a.keys, word_to_int))
+			return counter_to_sentence_pairs( count_sentence_matches([postings_a, postings_b]) )
+		
+		if self.engine == "minhash":
+			tokens      = [ self.tokens(i) for i in infiles ]
+			word_to_int = integerize_words( set(tokens[0]["vocabulary"].tolist()) & set(tokens[1]["vocabulary"].tolist()) )
+			id_lists    = [ token_id_lists(t, word_to_int) for t in tokens ]
+			return count_minhash_sentence_matches( id_lists[0], id_lists[1], id_bits(len(word_to_int)), self.window_size, self.step_size, self.ngram_size,
+				self.minhash_permutations, self.minhash_bands, self.workers )
+		
+		if self.engine == "sparse":
+			return count_sparse_sentence_matches(self.postings(text_a, text_b), self.block_rows, self.workers)
+		if self.engine == "external":
+			return list( self.iter_external_matches(text_a, text_b) )
+		return count_packed_sentence_matches( self.postings(text_a, text_b) )
+	
+	def iter_matches(self, text_a, text_b):
+		'''Read in two paths and yield, in sentence pair order, the (sentence_id_a, sentence_id_b, count) triples of the sentence pairs that share more than `threshold` ngrams
+		and rank within the `top_k` matches of their sentence of text_a. The packed and sparse engines drop sentences that cannot reach the threshold before counting,
+		and yield each block of `block_rows` sentences of text_a as soon as it has been counted'''
+		self.load_resources()
+		if self.engine == "sparse":
+			return iter_sparse_sentence_matches( self.postings(text_a, text_b), self.block_rows, self.workers, self.threshold, self.top_k )
+		if self.engine == "external":
+			return self.iter_external_matches(text_a, text_b, self.threshold, self.top_k)
+		if self.engine == "packed":
+			return iter_packed_sentence_matches( self.postings(text_a, text_b), self.block_rows, self.threshold, self.top_k )
+		return iter( select_sentence_pairs(self.count_matches(text_a, text_b), self.threshold, self.top_k) )
+	
+	def iter_external_matches(self, text_a, text_b, threshold=None, top_k=None):
+		'''Read in two paths, a threshold and a number of matches to keep per sentence of text_a, and yield the iter_external_sentence_matches() of the two texts'''
+		documents = [ self.external_tokens(i) for i in [text_a, text_b] ]
+		return iter_external_sentence_matches( documents, self.window_size, self.step_size, self.ngram_size, self.memory_budget, self.temp_dir, threshold, top_k )
+	
+	def compare(self, text_a, text_b):
+		'''Read in two paths and return the list of iter_matches() triples'''
+		return list( self.iter_matches(text_a, text_b) )
+	
 ###########
 # Globals #	
 ###########	
 
-ortho_dict   = create_ortho_dict()	
-stopwords    = create_stopwords()
-lemmatizer   = WordNetLemmatizer()
-stats_dict   = populate_stats()
-tokenizer    = data.load('tokenizers/punkt/english.pickle')
-shared_words = set(clean_words(read_file(sys.argv[1]))) & set(clean_words(read_file(sys.argv[2])))
-word_to_int  = integerize_words(shared_words)
+# Each resource is loaded by get_resource() the first time it is needed
+RESOURCE_LOADERS = {
+	"ortho_dict": create_ortho_dict,
+	"stopwords":  create_stopwords,
+	"lemmatizer": WordNetLemmatizer,
+	"stats_dict": populate_stats,
+	"tokenizer":  lambda: data.load('tokenizers/punkt/english.pickle'),
+	"word_memo":  lambda: WordMemo(normalize_word)
+}
+resources = {}
+
+# The engines a ReuseDetector counts matches with, and the prefilters it drops ngrams with
+ENGINES    = ["packed", "strings", "minhash", "sparse", "external"]
+PREFILTERS = ["bloom", "exact"]
+
+# The ASCII bytes that str.split() treats as whitespace, at which the external engine cuts the pieces of a file it reads
+WHITESPACE_BYTES = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+# The (sentence pair, count) records that the external engine sorts, keyed by sentence_one * file_two_length + sentence_two
+PAIR_RECORD_DTYPE = np.dtype( [("key", np.uint64), ("count", np.uint32)] )
+
+# The operands of the sparse product being computed, set before its worker pool forks
+sparse_operands = None
 		
 if __name__ == "__main__":
 	
-	results = []
-	infiles = [ sys.argv[1], sys.argv[2] ]
+	args     = parse_arguments()
+	if args.profile:
+		profiling.enable(args.profile_stage)
+	detector = ReuseDetector( args.window_size, args.step_size, args.ngram_size, threshold=args.threshold, engine=args.engine, workers=args.workers, cache_dir=args.cache_dir, cache_size=args.cache_size,
+		minhash_permutations=args.minhash_permutations, minhash_bands=args.minhash_bands, block_rows=args.block_rows, top_k=args.top_k, prefilter=args.prefilter,
+		memory_budget=args.memory_budget, temp_dir=args.temp_dir )
+	infiles  = [ args.text_one, args.text_two ]
 	
-	for i in infiles:
-		results.append(generate_ngrams(i))
+	try:
+		# Keep each text's tokens (the external engine keeps its sentence spans and token file) so that its sentences can be cut at the recorded spans instead of being split again
+		if args.engine != "strings":
+			detector.index(infiles)
+		matches  = detector.iter_matches(*infiles)
+		
+		if args.report_recall and args.engine == "minhash":
+			matches = list(matches)
+			detector.engine = "packed"
+			recall, found, total = pair_recall( detector.compare(*infiles), matches )
+			print "MinHash recall:", round(recall, 4), "(" + str(found), "of", total, "matches found by the exact engine)"
+		
+		if args.output_format == "binary":
+			write_match_store( matches, args.text_one, args.text_two, [detector.sentence_byte_spans(i) for i in infiles], detector.threshold )
+		else:
+			write_significant_matches( matches, args.text_one, args.text_two, detector.threshold, [detector.sentences(i) for i in infiles] )
+	finally:
+		detector.close()
 	
-	write_significant_matches( count_sentence_matches( results ) )
\ No newline at end of file
+	if args.profile:
+		profiling.write_report(args.profile)
\ No newline at end of file
@@ -0,0 +1,146 @@
+from combinatorial_ngrams import ReuseDetector, match_lines
+from match_store import MatchStore, match_records
+from itertools import combinations
+from multiprocessing import Pool
+from os import path, listdir, fsync
+import codecs, argparse
+
+'''Compare every text of one corpus with every text of another (or every pair of texts within one corpus), cleaning each
+text once and recording each finished pair in a checkpoint file so that an interrupted run can be resumed'''
+
+def read_corpus(corpus_path):
+	'''Read in the path of a directory or of a file listing one text path per line, and return the sorted, de-duplicated list of text paths it names'''
+	if path.isdir(corpus_path):
+		return sorted( path.join(corpus_path, f) for f in listdir(corpus_path) if path.isfile(path.join(corpus_path, f)) )
+	with codecs.open(corpus_path, "r", "utf-8") as f:
+		return sorted( set(line.strip() for line in f if line.strip()) )
+
+def corpus_pairs(texts_one, texts_two=None):
+	'''Read in one or two lists of paths, and return every (text_one, text_two) pair across the two lists, or every unordered pair of distinct texts in the one list'''
+	if texts_two is None:
+		return list( combinations(texts_one, 2) )
+	return [ (text_one, text_two) for text_one in texts_one for text_two in texts_two ]
+
+def read_checkpoint(checkpoint_path):
+	'''Read in the path of a checkpoint file and return the set of pairs it records as finished, the size the output file had when the last of them was written, and the length of the intact part of the checkpoint'''
+	finished          = set()
+	output_length     = 0
+	checkpoint_length = 0
+	if not path.exists(checkpoint_path):
+		return finished, output_length, checkpoint_length
+
+	with open(checkpoint_path, "rb") as f:
+		for line in f:
+			fields = line.decode("utf-8").rstrip("\n").split("\t")
+
+			# A line cut short by an interrupted write is not a finished pair
+			if not line.endswith(b"\n") or len(fields) != 3:
+				break
+			output_length      = int(fields[0])
+			checkpoint_length += len(line)
+			finished.add( (fields[1], fields[2]) )
+	return finished, output_length, checkpoint_length
+
+def compare_pair(pair):
+	'''Read in a (text_one, text_two) pair and return it along with the UTF-8 encoded matches.txt lines of its matching sentences, or their binary match records when writing to a match store; the process pool calls this with one pair at a time'''
+	text_one, text_two = pair
+	if store is not None:
+		records = match_records( store.document_id[text_one], store.document_id[text_two], list(detector.iter_matches(text_one, text_two)), detector.threshold )
+		return pair, records.tobytes()
+	sentences = [ detector.sentences(text_one), detector.sentences(text_two) ]
+	lines     = match_lines( detector.iter_matches(text_one, text_two), text_one, text_two, sentences, detector.threshold )
+	return pair, u"".join(lines).encode("utf-8")
+
+def compare_corpora(pairs, output_path, checkpoint_path, workers=1):
+	'''Read in a list of text pairs, the paths of the output and checkpoint files, and a number of workers, and append the matches of every pair not yet recorded in the checkpoint to the output file'''
+	finished, output_length, checkpoint_length = read_checkpoint(checkpoint_path)
+	pairs = [pair for pair in pairs if pair not in finished]
+
+	# Discard anything written after the last checkpointed pair; the pair it belonged to will be compared again
+	for file_path, length in [ (output_path, output_length), (checkpoint_path, checkpoint_length) ]:
+		if path.exists(file_path) and path.getsize(file_path) > length:
+			with open(file_path, "ab") as f:
+				f.truncate(length)
+
+	if workers > 1 and len(pairs) > 1:
+		# Each worker compares whole pairs, so it must not start pools of its own
+		detector.workers = 1
+		pool    = Pool(workers)
+		results = pool.imap_unordered(compare_pair, pairs)
+	else:
+		pool    = None
+		results = (compare_pair(pair) for pair in pairs)
+
+	try:
+		with open(output_path, "ab") as out, codecs.open(checkpoint_path, "a", "utf-8") as checkpoint:
+			for (text_one, text_two), matches in results:
+				out.write(matches)
+				out.flush()
+				fsync(out.fileno())
+
+				# A pair is only recorded once its matches are safely on disk
+				checkpoint.write( unicode(out.tell()) + "\t" + text_one + "\t" + text_two + "\n" )
+				checkpoint.flush()
+				fsync(checkpoint.fileno())
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+def parse_arguments():
+	'''Read the command line arguments and return them as a namespace'''
+	parser = argparse.ArgumentParser(description="Find the sentences that the texts of one or two corpora share combinatorial ngrams with")
+	parser.add_argument("corpus_one", help="a directory of texts, or a file listing one text path per line")
+	parser.add_argument("window_size", type=int, help="the size of the sliding window to be created")
+	parser.add_argument("step_size", type=int, help="number of words to advance the sliding window when it moves")
+	parser.add_argument("ngram_size", type=int, help="number of words to include in each ngram")
+	parser.add_argument("--corpus-two", help="a second directory or list of texts; every text of corpus_one is compared with every text of it. Without it, every pair of texts in corpus_one is compared once")
+	parser.add_argument("--engine", choices=["packed", "minhash", "sparse", "external"], default="packed", help="the engine used to count each pair's shared ngrams (default packed)")
+	parser.add_argument("--threshold", type=int, default=5, help="number of ngrams a sentence pair must share more than to count as a match (default 5)")
+	parser.add_argument("--top-k", type=int, help="keep only this many of the best matches of each sentence of the first text of a pair")
+	parser.add_argument("--memory-budget", type=int, default=1024, help="megabytes of records the external engine holds in memory at a time (default 1024)")
+	parser.add_argument("--temp-dir", help="directory in which the external engine writes its sorted run files")
+	parser.add_argument("--prefilter", choices=["bloom", "exact"], help="drop each ngram of the second text of a pair that the first text cannot share as soon as it is generated")
+	parser.add_argument("--workers", type=int, default=1, help="number of processes used to clean texts and compare pairs (default 1)")
+	parser.add_argument("--cache-dir", help="directory in which each text's cleaned tokens are cached between runs")
+	parser.add_argument("--cache-size", type=int, default=1024, help="size cap of the cache in megabytes (default 1024)")
+	parser.add_argument("--output-format", choices=["tsv", "binary"], default="tsv", help="tsv (default) appends both sentences of every match to a text file; binary appends fixed-width match records to a match store directory")
+	parser.add_argument("--output", help="file to which the matches of every pair are appended (default matches.txt), or with --output-format binary the match store directory (default matches)")
+	parser.add_argument("--checkpoint", default="matches.checkpoint", help="file recording the finished pairs; rerunning with the same checkpoint resumes an interrupted run (default matches.checkpoint)")
+	args = parser.parse_args()
+	if args.memory_budget < 1:
+		parser.error("--memory-budget must be at least 1 megabyte")
+	return args
+
+# The detector that compares pairs, created before the worker pool forks so that every worker inherits its cleaned texts
+detector = None
+
+# The match store that binary output is written to, with every text registered before the worker pool forks, or None for tsv output
+store = None
+
+if __name__ == "__main__":
+
+	args      = parse_arguments()
+	texts_one = read_corpus(args.corpus_one)
+	texts_two = read_corpus(args.corpus_two) if args.corpus_two else None
+	pairs     = corpus_pairs(texts_one, texts_two)
+
+	detector = ReuseDetector( args.window_size, args.step_size, args.ngram_size, threshold=args.threshold, engine=args.engine, workers=args.workers,
+		cache_dir=args.cache_dir, cache_size=args.cache_size, top_k=args.top_k, prefilter=args.prefilter,
+		memory_budget=args.memory_budget, temp_dir=args.temp_dir )
+
+	try:
+		# Clean each text that still takes part in an unfinished pair exactly once
+		finished = read_checkpoint(args.checkpoint)[0]
+		unfinished_texts = sorted( set(text for pair in pairs if pair not in finished for text in pair) )
+		detector.index(unfinished_texts)
+		
+		output_path = args.output or "matches.txt"
+		if args.output_format == "binary":
+			store = MatchStore(args.output or "matches")
+			for text in unfinished_texts:
+				store.add_document( text, detector.sentence_byte_spans(text) )
+			output_path = store.records_path
+		compare_corpora(pairs, output_path, args.checkpoint, args.workers)
+	finally:
+		detector.close()
@@ -0,0 +1,74 @@
+from os import path, makedirs, listdir, remove, rename, utime, getpid
+import numpy as np
+import hashlib
+
+'''Content-addressed, size-capped cache of NumPy arrays derived from documents (cleaned token ids).
+
+Each entry is one uncompressed .npz file named by the SHA-1 of everything the arrays depend on. Reading an entry
+refreshes its modification time, and storing an entry evicts the least recently used files until the cache fits its cap.'''
+
+# Bump this whenever the layout or meaning of cached arrays changes
+CACHE_VERSION = "2"
+
+def file_digest(file_path):
+	'''Read in a path and return the SHA-1 hex digest of that file's bytes'''
+	digest = hashlib.sha1()
+	with open(file_path, "rb") as f:
+		for block in iter(lambda: f.read(1 << 20), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+def cache_key(*parts):
+	'''Read in any number of strings and return a single hex digest identifying their combination'''
+	digest = hashlib.sha1(CACHE_VERSION)
+	for part in parts:
+		digest.update( unicode(part).encode("utf-8") + b"\0" )
+	return digest.hexdigest()
+
+def entry_path(cache_dir, key):
+	'''Read in a cache directory and key and return the path of that key's entry'''
+	return path.join(cache_dir, key + ".npz")
+
+def load_entry(cache_dir, key):
+	'''Read in a cache directory and key and return a dictionary of the arrays stored under that key, or None on a miss'''
+	file_path = entry_path(cache_dir, key)
+	try:
+		with np.load(file_path) as entry:
+			arrays = dict( (name, entry[name]) for name in entry.files )
+	except (IOError, OSError):
+		return None
+	# Mark the entry as recently used
+	utime(file_path, None)
+	return arrays
+
+def store_entry(cache_dir, key, arrays, max_bytes):
+	'''Read in a cache directory, key, dictionary of arrays and size cap, write those arrays to the cache, and evict old entries until the cache fits the cap'''
+	if not path.exists(cache_dir):
+		makedirs(cache_dir)
+	# Write under a temporary name and then rename, so concurrent readers never see a partial entry
+	temporary_path = entry_path(cache_dir, key) + "." + str(getpid()) + ".tmp"
+	with open(temporary_path, "wb") as out:
+		np.savez(out, **arrays)
+	rename(temporary_path, entry_path(cache_dir, key))
+	evict_entries(cache_dir, max_bytes)
+
+def evict_entries(cache_dir, max_bytes):
+	'''Read in a cache directory and size cap, and remove least recently used entries until the directory's entries fit within the cap'''
+	entries = []
+	for file_name in listdir(cache_dir):
+		if file_name.endswith(".npz"):
+			file_path = path.join(cache_dir, file_name)
+			try:
+				entries.append( (path.getmtime(file_path), path.getsize(file_path), file_path) )
+			except OSError:
+				continue
+
+	total_bytes = sum(size for modified, size, file_path in entries)
+	for modified, size, file_path in sorted(entries):
+		if total_bytes <= max_bytes:
+			break
+		try:
+			remove(file_path)
+		except OSError:
+			pass
+		total_bytes -= size
@@ -0,0 +1,81 @@
+from os import path, remove
+import numpy as np
+
+'''Sort record arrays that do not fit in memory. Blocks of records are buffered until a run's worth has arrived, sorted by
+their "key" field and written to a run file; the run files are then merged a chunk at a time, reading each through a
+memory map. Every merged chunk holds every record of the keys it contains, so a consumer can treat the chunks as
+independent groups of keys.'''
+
+def sort_records(records):
+	'''Read in a structured array with a "key" field and return it sorted by key, keeping records with equal keys in their input order'''
+	return records[ np.argsort(records["key"], kind="mergesort") ]
+
+def write_runs(record_blocks, run_dir, prefix, run_records, combine=None):
+	'''Read in an iterable of structured record arrays, a directory, a file name prefix, the number of records to sort at a time and an optional function that reduces a sorted run (e.g. by summing the values of equal keys), and write the records to sorted run files, returning their paths in the order they were written'''
+	run_paths = []
+	buffered  = []
+	count     = 0
+	for records in record_blocks:
+		buffered.append(records)
+		count += len(records)
+		if count >= run_records:
+			run_paths.append( write_run(buffered, run_dir, prefix, len(run_paths), combine) )
+			buffered = []
+			count    = 0
+	if count:
+		run_paths.append( write_run(buffered, run_dir, prefix, len(run_paths), combine) )
+	return run_paths
+
+def write_run(buffered, run_dir, prefix, run_number, combine=None):
+	'''Read in a list of record arrays, a directory, a file name prefix, the number of the run and an optional reducing function, and write the sorted records to a run file, returning its path'''
+	records = sort_records( np.concatenate(buffered) )
+	if combine is not None:
+		records = combine(records)
+	run_path = path.join( run_dir, prefix + "-" + str(run_number) + ".npy" )
+	np.save(run_path, records)
+	return run_path
+
+def merge_runs(run_paths, merge_records, max_runs=64):
+	'''Read in the paths of sorted run files and the number of records to hold at a time, and yield the records of all runs merged in key order, a chunk at a time; every chunk holds all records of its keys, and records with equal keys keep the order of the runs they came from. Runs are first merged `max_runs` at a time into longer runs until no more than `max_runs` are left, so that no more files are open at once'''
+	merge_pass = 0
+	while len(run_paths) > max_runs:
+		run_paths   = [ write_merged_run(run_paths[start:start + max_runs], merge_records, merge_pass, start // max_runs) for start in xrange(0, len(run_paths), max_runs) ]
+		merge_pass += 1
+
+	runs          = [ np.load(run_path, mmap_mode="r") for run_path in run_paths ]
+	positions     = [0] * len(runs)
+	chunk_records = max( 1, merge_records // max(1, len(runs)) )
+	while any( position < len(run) for run, position in zip(runs, positions) ):
+		windows = [ run[position:position + chunk_records] for run, position in zip(runs, positions) ]
+
+		# Records below the smallest last key of the runs that continue past their window are known to be complete; if a
+		# single key fills a whole window, every record of that key is read instead, however many there are
+		last_keys = [ window["key"][-1] for run, position, window in zip(runs, positions, windows) if position + len(window) < len(run) ]
+		bound     = np.sort( np.array(last_keys, dtype=runs[0].dtype["key"]) )[0] if last_keys else None
+		takes     = [ len(window) if bound is None else int(np.searchsorted(window["key"], bound, side="left")) for window in windows ]
+		if not sum(takes):
+			takes = [ int(np.searchsorted(run["key"][position:], bound, side="right")) for run, position in zip(runs, positions) ]
+
+		taken = []
+		for i, run in enumerate(runs):
+			taken.append( np.array(run[positions[i]:positions[i] + takes[i]]) )
+			positions[i] += takes[i]
+		yield sort_records( np.concatenate(taken) )
+
+def write_merged_run(run_paths, merge_records, merge_pass, group):
+	'''Read in the paths of sorted run files, the number of records to hold at a time, and the numbers of the merge pass and of the group of runs within it, merge the runs into one run file, remove the merged runs, and return the path of the new run'''
+	runs     = [ np.load(run_path, mmap_mode="r") for run_path in run_paths ]
+	run_path = path.join( path.dirname(run_paths[0]), "merged-" + str(merge_pass) + "-" + str(group) + ".npy" )
+	merged   = np.lib.format.open_memmap( run_path, mode="w+", dtype=runs[0].dtype, shape=(sum(len(run) for run in runs),) )
+	del runs
+
+	position = 0
+	for records in merge_runs(run_paths, merge_records):
+		merged[position:position + len(records)] = records
+		position += len(records)
+	merged.flush()
+	del merged
+
+	for merged_path in run_paths:
+		remove(merged_path)
+	return run_path
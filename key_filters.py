@@ -0,0 +1,81 @@
+from ngram_postings import find_keys
+import numpy as np
+
+'''Filters built from the packed ngram keys of one text, used to discard the ngrams of another text that cannot be shared
+as soon as they are generated, rather than after both texts' ngrams have been stored in full. An ExactKeyFilter keeps the
+sorted distinct keys themselves; a BloomFilter keeps about `bits_per_key` bits per key and lets a small share of unshared
+keys through, which only costs the memory they take, since unshared keys never match anything.'''
+
+# Odd 64-bit constants of the splitmix64 finalizer
+MIX_CONSTANTS = [ np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb) ]
+SECOND_SEED   = np.uint64(0x9e3779b97f4a7c15)
+
+class ExactKeyFilter(object):
+	'''The sorted distinct keys of a text, searched with binary search'''
+
+	def __init__(self, keys, bits):
+		'''Read in an array of packed keys and the number of bits per word id they were packed with'''
+		self.keys = np.unique(keys)
+		self.bits = bits
+
+	def contains(self, keys):
+		'''Read in an array of packed keys and return a mask of the keys the filter holds'''
+		return find_keys(self.keys, keys)[1]
+
+class BloomFilter(object):
+	'''A Bloom filter over packed keys, with `hashes` bit positions per key derived from two independent 64-bit hashes'''
+
+	def __init__(self, keys, bits, bits_per_key=10, hashes=7, chunk_size=1 << 20):
+		'''Read in an array of packed keys, the number of bits per word id they were packed with, the filter size per key and the number of hashes per key; the positions of a chunk of keys are computed at a time to bound memory'''
+		self.bits   = bits
+		self.hashes = hashes
+		size        = 1 << max( 6, int(len(keys) * bits_per_key - 1).bit_length() )
+		self.mask   = np.uint64(size - 1)
+		self.array  = np.zeros(size // 8, dtype=np.uint8)
+
+		for chunk_start in xrange(0, len(keys), chunk_size):
+			positions   = np.unique( self.positions(keys[chunk_start:chunk_start + chunk_size]) )
+			byte_ids    = positions >> np.uint64(3)
+			byte_starts = np.flatnonzero( np.append(True, byte_ids[1:] != byte_ids[:-1]) )
+			bit_values  = np.left_shift( np.uint8(1), (positions & np.uint64(7)).astype(np.uint8) )
+			self.array[ byte_ids[byte_starts] ] |= np.bitwise_or.reduceat(bit_values, byte_starts)
+
+	def positions(self, keys):
+		'''Read in an array of packed keys and return a (keys x hashes) array of the bit positions of each'''
+		first, second = key_hashes(keys)
+		with np.errstate(over="ignore"):
+			return ( first[:, None] + np.arange(self.hashes, dtype=np.uint64) * (second | np.uint64(1))[:, None] ) & self.mask
+
+	def contains(self, keys):
+		'''Read in an array of packed keys and return a mask of the keys that may be in the filter; every key that is in it is found'''
+		positions = self.positions(keys)
+		set_bits  = np.right_shift( self.array[positions >> np.uint64(3)], (positions & np.uint64(7)).astype(np.uint8) ) & np.uint8(1)
+		return set_bits.all(axis=1)
+
+def mix(values):
+	'''Read in an array of uint64 values and return the splitmix64 finalizer of each, which spreads every input bit over every output bit'''
+	with np.errstate(over="ignore"):
+		values = (values ^ (values >> np.uint64(30))) * MIX_CONSTANTS[0]
+		values = (values ^ (values >> np.uint64(27))) * MIX_CONSTANTS[1]
+		return values ^ (values >> np.uint64(31))
+
+def key_hashes(keys):
+	'''Read in an array of packed keys, uint64 or raw big-endian rows, and return two independent uint64 hashes of each key'''
+	keys = np.ascontiguousarray(keys)
+	if keys.dtype.kind == "V":
+		# Fold the 32-bit columns of a wide key into one value
+		columns = keys.view(">u4").reshape(len(keys), keys.dtype.itemsize // 4).astype(np.uint64)
+		values  = np.zeros(len(keys), dtype=np.uint64)
+		for column in columns.T:
+			values = mix(values ^ column)
+	else:
+		values = keys.astype(np.uint64)
+	return mix(values), mix(values ^ SECOND_SEED)
+
+def build_key_filter(kind, keys, bits):
+	'''Read in the kind of filter ("bloom" or "exact"), an array of packed keys and the number of bits per word id they were packed with, and return a filter holding those keys'''
+	if kind == "bloom":
+		return BloomFilter(keys, bits)
+	if kind == "exact":
+		return ExactKeyFilter(keys, bits)
+	raise ValueError("unknown key filter: " + kind)
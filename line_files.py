@@ -0,0 +1,14 @@
+import codecs
+
+'''Write lists of strings to UTF-8 text files one per line, and read them back.'''
+
+def write_lines(file_path, lines):
+	'''Read in a path and a list of strings, and write those strings to disk one per line'''
+	with codecs.open(file_path, "w", "utf-8") as out:
+		for line in lines:
+			out.write( line + "\n" )
+
+def read_lines(file_path):
+	'''Read in a path written by write_lines() and return its list of strings'''
+	with codecs.open(file_path, "r", "utf-8") as f:
+		return f.read().split("\n")[:-1]
@@ -0,0 +1,195 @@
+from __future__ import division
+from os import path, makedirs, rename, remove, listdir
+from itertools import islice
+from line_files import write_lines, read_lines
+import numpy as np
+import codecs, argparse
+
+'''A compact store of matched sentence pairs: fixed-width binary records that point into the matched documents, rather
+than copies of both sentences for every pair.
+
+A store is a directory holding
+	records.bin     one MATCH_DTYPE record (doc_a, sentence_a, doc_b, sentence_b, score) per match, appended in order
+	documents.txt   the path of each document, one per line; a record's doc_a and doc_b are positions in this list
+	offsets/{id}.npy  the (start, end) byte offsets of each sentence of document {id} in that document's file
+
+The sentence offsets are byte positions in the file on disk, so a sentence is recovered by reading just its own bytes.
+Runs of whitespace are collapsed to single spaces, as read_file() does, so recovered sentences are identical to those
+written to matches.txt. To convert a store to matches.txt, run `python match_store.py to-tsv {store}`.'''
+
+MATCH_DTYPE = np.dtype([ ("doc_a", "<u4"), ("sentence_a", "<u4"), ("doc_b", "<u4"), ("sentence_b", "<u4"), ("score", "<f4") ])
+
+def token_starts(text):
+	'''Read in a unicode string and return its whitespace-separated tokens along with the position at which each token starts'''
+	tokens   = text.split()
+	starts   = np.zeros(len(tokens), dtype=np.int64)
+	position = 0
+	for i, token in enumerate(tokens):
+		position  = text.find(token, position)
+		starts[i] = position
+		position += len(token)
+	return tokens, starts
+
+def utf8_offsets(text):
+	'''Read in a unicode string and return the byte offset at which each of its characters starts in its UTF-8 encoding, followed by the length of the whole encoding'''
+	code_points = np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+	return np.concatenate( ([0], np.cumsum(1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000))) ).astype(np.int64)
+
+def raw_byte_spans(file_path, spans):
+	'''Read in a path and the (start, end) character spans of sentences in the read_file() text of that path, and return the (start, end) byte offsets of the same sentences in the file on disk'''
+	with open(file_path, "rb") as f:
+		text = f.read().decode("utf-8")
+
+	# read_file() joins the whitespace-separated tokens of the file with single spaces; find where each token starts in both texts
+	tokens, raw_starts = token_starts(text)
+	raw_starts     = np.append(raw_starts, len(text))
+	clean_starts   = np.cumsum( [0] + [len(token) + 1 for token in tokens] ).astype(np.int64)
+
+	spans  = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+	starts = np.searchsorted(clean_starts, spans[:, 0], side="right") - 1
+	ends   = np.searchsorted(clean_starts, spans[:, 1] - 1, side="right") - 1
+	raw    = np.column_stack( (raw_starts[starts] + spans[:, 0] - clean_starts[starts], raw_starts[ends] + spans[:, 1] - clean_starts[ends]) )
+
+	# Convert character positions to byte positions by summing the UTF-8 length of every character before them
+	return utf8_offsets(text)[raw]
+
+class MatchStore(object):
+	'''Append match records to a store directory and read them back, recovering the text of matched sentences on demand'''
+
+	def __init__(self, store_dir):
+		'''Read in the path of a store directory, creating an empty store there if there is none'''
+		self.store_dir    = store_dir
+		self.records_path = path.join(store_dir, "records.bin")
+		if not path.exists( path.join(store_dir, "offsets") ):
+			makedirs( path.join(store_dir, "offsets") )
+		if not path.exists(self.records_path):
+			open(self.records_path, "ab").close()
+		self.documents   = read_lines( path.join(store_dir, "documents.txt") ) if path.exists( path.join(store_dir, "documents.txt") ) else []
+		self.document_id = dict( (document, i) for i, document in enumerate(self.documents) )
+		self.sentences   = {}
+
+	def add_document(self, file_path, byte_spans):
+		'''Read in the path of a document and the raw_byte_spans() of its sentences, register the document if the store does not hold it yet, and return its id'''
+		if file_path not in self.document_id:
+			document_id = len(self.documents)
+			np.save( path.join(self.store_dir, "offsets", str(document_id) + ".npy"), byte_spans )
+
+			# The offsets are written first, so a reader never finds a document without them
+			self.documents.append(file_path)
+			self.document_id[file_path] = document_id
+			write_lines( path.join(self.store_dir, "documents.txt.tmp"), self.documents )
+			rename( path.join(self.store_dir, "documents.txt.tmp"), path.join(self.store_dir, "documents.txt") )
+		return self.document_id[file_path]
+
+	def append(self, document_a, document_b, sentence_pairs, threshold=5, chunk_size=65536):
+		'''Read in the ids of two documents and an iterable of (sentence_id_a, sentence_id_b, count) triples, and append a record for each pair that shares more than `threshold` ngrams, writing a chunk of records at a time as the triples arrive; return the number of records written'''
+		sentence_pairs = iter(sentence_pairs)
+		written        = 0
+		with open(self.records_path, "ab") as out:
+			while True:
+				chunk = list( islice(sentence_pairs, chunk_size) )
+				if not chunk:
+					return written
+				records = match_records(document_a, document_b, chunk, threshold)
+				out.write( records.tobytes() )
+				written += len(records)
+
+	def records(self):
+		'''Return a read-only memory-mapped array of every record in the store'''
+		if not path.getsize(self.records_path):
+			return np.zeros(0, dtype=MATCH_DTYPE)
+		return np.memmap(self.records_path, dtype=MATCH_DTYPE, mode="r")
+
+	def sentence(self, document_id, sentence_id):
+		'''Read in a document id and the position of one of its sentences, and return the text of that sentence, reading only its bytes from the document'''
+		if document_id not in self.sentences:
+			self.sentences[document_id] = DocumentSentences( self.documents[document_id], np.load(path.join(self.store_dir, "offsets", str(document_id) + ".npy"), mmap_mode="r") )
+		return self.sentences[document_id][sentence_id]
+
+	def rows(self):
+		'''Yield the (path_a, path_b, score, sentence_a, sentence_b) of every record in the store, in order'''
+		for doc_a, sentence_a, doc_b, sentence_b, score in self.records().tolist():
+			yield self.documents[doc_a], self.documents[doc_b], score, self.sentence(doc_a, sentence_a), self.sentence(doc_b, sentence_b)
+
+	def close(self):
+		'''Close the document files opened to read sentences'''
+		for sentences in self.sentences.values():
+			sentences.close()
+		self.sentences = {}
+
+class DocumentSentences(object):
+	'''The sentences of a document, each read from the file on disk only when it is asked for'''
+
+	def __init__(self, file_path, byte_spans):
+		'''Read in the path of a document and the raw_byte_spans() of its sentences'''
+		self.file_path  = file_path
+		self.byte_spans = byte_spans
+		self.file       = None
+
+	def __len__(self):
+		return len(self.byte_spans)
+
+	def __getitem__(self, sentence_id):
+		'''Read in the position of a sentence and return its text, with runs of whitespace collapsed as read_file() does'''
+		if self.file is None:
+			self.file = open(self.file_path, "rb")
+		start, end = self.byte_spans[sentence_id]
+		self.file.seek(start)
+		return u" ".join( self.file.read(end - start).decode("utf-8").split() )
+
+	def close(self):
+		'''Close the document file if it has been opened'''
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+def match_records(document_a, document_b, sentence_pairs, threshold=5):
+	'''Read in the ids of two documents and a list of (sentence_id_a, sentence_id_b, count) triples, and return a MATCH_DTYPE array holding a record for each pair that shares more than `threshold` ngrams'''
+	sentence_pairs = [pair for pair in sentence_pairs if pair[2] > threshold]
+	records = np.zeros(len(sentence_pairs), dtype=MATCH_DTYPE)
+	if sentence_pairs:
+		sentence_a, sentence_b, scores = zip(*sentence_pairs)
+		records["doc_a"]      = document_a
+		records["doc_b"]      = document_b
+		records["sentence_a"] = sentence_a
+		records["sentence_b"] = sentence_b
+		records["score"]      = scores
+	return records
+
+def create_store(store_dir):
+	'''Read in the path of a store directory, remove any store already there, and return an empty MatchStore'''
+	if path.exists(store_dir):
+		for file_name in ["records.bin", "documents.txt"]:
+			if path.exists( path.join(store_dir, file_name) ):
+				remove( path.join(store_dir, file_name) )
+		if path.exists( path.join(store_dir, "offsets") ):
+			for file_name in listdir( path.join(store_dir, "offsets") ):
+				remove( path.join(store_dir, "offsets", file_name) )
+	return MatchStore(store_dir)
+
+def format_score(score):
+	'''Read in a record's score and return it as matches.txt writes it: an integer when the score is whole'''
+	return unicode( int(score) ) if score == int(score) else unicode(score)
+
+def write_tsv(store, output_path):
+	'''Read in a MatchStore and a path, and write the store's matches to that path in the matches.txt format'''
+	with codecs.open(output_path, "w", "utf-8") as out:
+		for path_a, path_b, score, sentence_a, sentence_b in store.rows():
+			out.write( path_a + "\t" + path_b + "\t" + format_score(score) + "\t" + sentence_a + "\t" + sentence_b + "\n" )
+
+def parse_arguments():
+	'''Read the command line arguments and return them as a namespace'''
+	parser     = argparse.ArgumentParser(description="Convert a binary match store to the tab-separated matches.txt format")
+	subparsers = parser.add_subparsers(dest="command")
+
+	to_tsv = subparsers.add_parser("to-tsv", help="write the matches of a store as tab-separated text")
+	to_tsv.add_argument("store_dir", help="directory of a match store")
+	to_tsv.add_argument("output", nargs="?", default="matches.txt", help="path of the tab-separated output (default matches.txt)")
+	return parser.parse_args()
+
+if __name__ == "__main__":
+
+	args  = parse_arguments()
+	store = MatchStore(args.store_dir)
+	write_tsv(store, args.output)
+	store.close()
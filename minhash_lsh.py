@@ -0,0 +1,40 @@
+import numpy as np
+
+'''MinHash sketches of each sentence's set of word ids, and banded locality-sensitive hashing of those sketches, used to
+find candidate sentence pairs without enumerating every combinatorial ngram of every window'''
+
+# Hash values are computed modulo this Mersenne prime so that products of two values below it fit in 64 bits
+MERSENNE_PRIME = (1 << 31) - 1
+
+def hash_parameters(num_permutations, seed=1):
+	'''Read in the number of hash functions and a random seed, and return the (a, b) coefficients of each function h(x) = (a * x + b) mod p'''
+	random = np.random.RandomState(seed)
+	a = random.randint(1, MERSENNE_PRIME, num_permutations, dtype=np.int64).astype(np.uint64)
+	b = random.randint(0, MERSENNE_PRIME, num_permutations, dtype=np.int64).astype(np.uint64)
+	return a, b
+
+def minhash_signatures(id_lists, num_permutations=64, seed=1, chunk_size=2000):
+	'''Read in a list holding the word ids of each sentence, and return the positions of the non-empty sentences along with a (sentences x num_permutations) array of their MinHash signatures'''
+	a, b         = hash_parameters(num_permutations, seed)
+	sentence_ids = np.array([i for i, ids in enumerate(id_lists) if ids], dtype=np.int64)
+	signatures   = np.empty((len(sentence_ids), num_permutations), dtype=np.uint64)
+
+	# Hash a chunk of sentences at a time to bound the size of the (words x permutations) hash matrix
+	for chunk_start in xrange(0, len(sentence_ids), chunk_size):
+		word_sets = [np.unique(id_lists[i]) for i in sentence_ids[chunk_start:chunk_start + chunk_size]]
+		starts    = np.cumsum([0] + [len(word_set) for word_set in word_sets[:-1]])
+		ids       = np.concatenate(word_sets).astype(np.uint64)
+		hashes    = (ids[:, None] * a + b) % np.uint64(MERSENNE_PRIME)
+		signatures[chunk_start:chunk_start + len(word_sets)] = np.minimum.reduceat(hashes, starts, axis=0)
+
+	return sentence_ids, signatures
+
+def band_keys(signatures, bands, seed=1):
+	'''Read in a (sentences x permutations) signature array and a number of bands, and return a (sentences x bands) array in which each entry hashes one band of a signature'''
+	rows        = signatures.shape[1] // bands
+	multipliers = np.random.RandomState(seed).randint(1, MERSENNE_PRIME, rows, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+	banded      = signatures[:, :bands * rows].reshape(len(signatures), bands, rows)
+
+	# Products and sums wrap around modulo 2**64, which is all a bucket key needs
+	with np.errstate(over="ignore"):
+		return (banded * multipliers).sum(axis=2, dtype=np.uint64)
@@ -0,0 +1,48 @@
+import numpy as np
+
+'''Compact postings lists: the sentences each distinct ngram of a text occurs in, held in three flat arrays rather than
+in a Python list per ngram. A run of sorted sentence ids is stored as its first id followed by the gaps between
+consecutive ids, so a posting costs four bytes and a distinct ngram costs one key and one offset.'''
+
+class NgramPostings(object):
+	'''The sorted distinct ngram keys of a text, the offset at which each key's run of sentence ids begins (followed by the end of the last run), and the delta-encoded runs themselves'''
+
+	def __init__(self, keys, sentence_ids):
+		'''Read in aligned arrays of packed ngram keys and the sentence ids they occur in, in any order, and build the postings with one sort'''
+		keys         = np.asarray(keys)
+		sentence_ids = np.asarray(sentence_ids, dtype=np.int64)
+
+		# Sort by sentence id, then stably by key, so every key's run of sentence ids is in ascending order
+		order        = np.argsort(sentence_ids, kind="mergesort")
+		order        = order[ np.argsort(keys[order], kind="mergesort") ]
+		keys         = keys[order]
+		sentence_ids = sentence_ids[order]
+
+		run_start     = np.ones(len(keys), dtype=bool)
+		run_start[1:] = keys[1:] != keys[:-1]
+		run_starts    = np.flatnonzero(run_start)
+
+		self.keys    = keys[run_starts]
+		self.offsets = np.append(run_starts, len(keys)).astype(np.int64)
+		self.deltas  = np.diff( np.append(0, sentence_ids) ).astype(np.uint32)
+		self.deltas[run_starts] = sentence_ids[run_starts]
+
+	def __len__(self):
+		'''Return the number of distinct ngrams'''
+		return len(self.keys)
+
+	def run(self, position):
+		'''Read in the position of a key and return the sorted sentence ids of its run'''
+		return np.cumsum( self.deltas[self.offsets[position]:self.offsets[position + 1]], dtype=np.int64 )
+
+	def intersect(self, other):
+		'''Read in another NgramPostings and return the positions, in this one and in the other, of the keys the two share'''
+		positions, found = find_keys(other.keys, self.keys)
+		return np.flatnonzero(found), positions[found]
+
+def find_keys(sorted_keys, keys):
+	'''Read in a sorted array of unique keys and an array of keys, and return the position of each key in the sorted array along with a mask of the keys found there'''
+	positions = np.searchsorted(sorted_keys, keys)
+	found     = positions < len(sorted_keys)
+	found[found] = sorted_keys[ positions[found] ] == keys[found]
+	return positions, found
@@ -0,0 +1,94 @@
+from __future__ import division
+from os import path
+import cProfile, resource, time, json
+
+'''Opt-in instrumentation of pipeline stages. A stage is any block of code wrapped in `with stage(name) as s:`, which may
+set `s.items` to the number of items it processed. While no profiler is enabled, stages cost a few attribute lookups and
+record nothing; once enable() has been called, every run of every stage adds its wall time and items to that stage's
+totals, and the peak resident set size reached so far is noted when the stage ends.
+
+Stages that run inside worker processes are not recorded, but the stages that wait for those workers are, and the
+largest worker's peak memory is reported separately.'''
+
+class Profiler(object):
+	'''Accumulate the calls, wall time, items and peak memory of each named stage, and optionally a cProfile of one stage'''
+
+	def __init__(self, cprofile_stage=None):
+		'''Read in the name of the stage to run under cProfile, or None to profile no stage'''
+		self.started        = time.time()
+		self.stages         = {}
+		self.order          = []
+		self.cprofile_stage = cprofile_stage
+		self.cprofile       = cProfile.Profile() if cprofile_stage else None
+
+	def record(self, name, seconds, items):
+		'''Read in a stage name, the wall time of one run of that stage and the number of items it processed (or None), and add them to the stage's totals'''
+		if name not in self.stages:
+			self.stages[name] = {"stage": name, "calls": 0, "seconds": 0.0, "items": None, "peak_rss_kb": 0}
+			self.order.append(name)
+		totals = self.stages[name]
+		totals["calls"]      += 1
+		totals["seconds"]    += seconds
+		totals["peak_rss_kb"] = peak_rss_kb()
+		if items is not None:
+			totals["items"] = (totals["items"] or 0) + items
+
+	def report(self):
+		'''Return a dictionary describing the whole run and each stage in the order the stages first ran'''
+		stages = []
+		for name in self.order:
+			totals = dict(self.stages[name])
+			totals["items_per_second"] = totals["items"] / totals["seconds"] if totals["items"] is not None and totals["seconds"] > 0 else None
+			stages.append(totals)
+		return {
+			"total_seconds":        time.time() - self.started,
+			"peak_rss_kb":          peak_rss_kb(),
+			"children_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+			"cprofile_stage":       self.cprofile_stage,
+			"stages":               stages
+		}
+
+class stage(object):
+	'''A context manager that times one run of a named stage for the enabled profiler, and does nothing when none is enabled'''
+
+	def __init__(self, name, items=None):
+		'''Read in the stage name and, if it is already known, the number of items the stage will process'''
+		self.name  = name
+		self.items = items
+
+	def __enter__(self):
+		if profiler is not None:
+			if profiler.cprofile_stage == self.name:
+				profiler.cprofile.enable()
+			self.started = time.time()
+		return self
+
+	def __exit__(self, exception_type, exception, traceback):
+		if profiler is not None:
+			seconds = time.time() - self.started
+			if profiler.cprofile_stage == self.name:
+				profiler.cprofile.disable()
+			profiler.record(self.name, seconds, self.items)
+		return False
+
+def peak_rss_kb():
+	'''Return the largest resident set size this process has reached so far, in kilobytes'''
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def enable(cprofile_stage=None):
+	'''Read in the name of a stage to run under cProfile (or None), start recording every stage, and return the profiler'''
+	global profiler
+	profiler = Profiler(cprofile_stage)
+	return profiler
+
+def write_report(report_path):
+	'''Read in a path, write the enabled profiler's report to it as JSON, and write the cProfile statistics of the profiled stage, if any, next to it with a .prof extension'''
+	report = profiler.report()
+	if profiler.cprofile is not None:
+		report["cprofile_path"] = path.splitext(report_path)[0] + ".prof"
+		profiler.cprofile.dump_stats(report["cprofile_path"])
+	with open(report_path, "w") as out:
+		json.dump(report, out, indent=2)
+
+# The profiler that stages report to, or None while profiling is off
+profiler = None
@@ -0,0 +1,347 @@
+from __future__ import division
+from combinatorial_ngrams import pack_ngrams, unpack_ngrams, id_bits, sort_postings, expand_blocks, find_keys
+from combinatorial_ngrams import document_tokens, document_sentences, token_id_lists, shared_token_ids, sentence_id_lists, id_list_ngram_rows
+from match_store import raw_byte_spans, DocumentSentences
+from line_files import write_lines, read_lines
+from contextlib import contextmanager
+from tempfile import mkdtemp
+from subprocess import Popen
+from os import path, makedirs, rename, remove, getpid
+import os, shutil, time, sys
+import numpy as np
+import codecs, json, argparse
+
+'''Build a persistent, memory-mapped ngram -> (document, sentence) index for a reference corpus, and stream new texts against it.
+
+Unlike combinatorial_ngrams.py, which restricts both texts to the words they share before windowing, the index restricts
+every text to the vocabulary of the whole reference corpus. Reference windows may therefore contain words the query lacks,
+so counts can be lower than those of a pairwise comparison of the same two texts.
+
+The index is a list of append-only segments, each holding the ngrams of the texts added in one call. Word ids come from a
+vocabulary that only ever grows, so adding a text writes one new segment and never rewrites an existing one. A manifest
+names the live segments and the number of vocabulary words and documents they cover; it is replaced by an atomic rename,
+so readers always see a consistent index. Once more than a set number of segments exist, they are merged into one by a
+background process. One process at a time may add texts to an index.
+
+The byte offsets of each indexed document's sentences are saved alongside its segments, so that a query reads only the
+sentences it matches from the library files rather than splitting every matched document again.'''
+
+POSTING_DTYPE = np.dtype([ ("document", "<u4"), ("sentence", "<u4") ])
+
+# Adding a text to an index with more segments than this starts a background merge
+MAX_SEGMENTS = 8
+
+####################
+# Building Methods #
+####################
+
+def create_index(index_dir, window_size, step_size, ngram_size):
+	'''Read in an output directory and the combinatorial parameters, and write an empty index to that directory'''
+	if not path.exists( path.join(index_dir, "offsets") ):
+		makedirs( path.join(index_dir, "offsets") )
+	with open( path.join(index_dir, "meta.json"), "w" ) as out:
+		json.dump( {"window_size": window_size, "step_size": step_size, "ngram_size": ngram_size}, out )
+	replace_lines( path.join(index_dir, "vocabulary.txt"), [] )
+	replace_lines( path.join(index_dir, "documents.txt"), [] )
+	write_manifest( index_dir, {"segments": [], "vocabulary_size": 0, "documents": 0} )
+
+def build_index(index_dir, text_files, window_size, step_size, ngram_size, workers=1):
+	'''Read in an output directory, a list of paths, and the combinatorial parameters, and write an index of every ngram in those files to disk'''
+	create_index(index_dir, window_size, step_size, ngram_size)
+	add_texts(index_dir, text_files, workers)
+
+def add_texts(index_dir, text_files, workers=1, tokens=None):
+	'''Read in an index directory, a list of paths and optionally the document_tokens() of those files, and add the ngrams of those files to the index as one new segment, extending the vocabulary with any words it lacks'''
+	index = load_index(index_dir)
+	if tokens is None:
+		tokens = [document_tokens(text_file, workers) for text_file in text_files]
+
+	# New words are appended, so every word keeps the id it was first given
+	vocabulary  = index["vocabulary"] + sorted( set(w for t in tokens for w in t["vocabulary"].tolist()) - set(index["vocabulary"]) )
+	word_to_int = dict( (w, i) for i, w in enumerate(vocabulary) )
+	documents   = index["documents"] + list(text_files)
+	bits        = id_bits(len(vocabulary))
+	keys        = []
+	postings    = []
+
+	for document_id, document in enumerate(tokens, len(index["documents"])):
+		ngram_rows, sentence_ids = id_list_ngram_rows( token_id_lists(document, word_to_int), index["window_size"], index["step_size"], index["ngram_size"], workers )
+		document_postings = np.empty(len(sentence_ids), dtype=POSTING_DTYPE)
+		document_postings["document"] = document_id
+		document_postings["sentence"] = sentence_ids
+		keys.append( pack_ngrams(ngram_rows, bits) )
+		postings.append( document_postings )
+		np.save( path.join(index_dir, "offsets", str(document_id) + ".npy"), raw_byte_spans(documents[document_id], document["sentence_spans"]) )
+
+	# Readers only use the first vocabulary_size words and documents named by the manifest, so lines and offsets written ahead of it are harmless
+	replace_lines( path.join(index_dir, "vocabulary.txt"), vocabulary )
+	replace_lines( path.join(index_dir, "documents.txt"), documents )
+	segment_name = write_segment( index_dir, np.concatenate(keys), np.concatenate(postings), bits, len(vocabulary) )
+
+	with manifest_lock(index_dir):
+		manifest = read_manifest(index_dir)
+		manifest["segments"].append(segment_name)
+		manifest["vocabulary_size"] = len(vocabulary)
+		manifest["documents"]       = len(documents)
+		write_manifest(index_dir, manifest)
+	return len(manifest["segments"])
+
+def write_segment(index_dir, keys, postings, bits, vocabulary_size):
+	'''Read in an index directory, aligned arrays of packed keys and postings, the bits per word id and the number of vocabulary words those keys can hold, write them to a new segment directory, and return its name'''
+	# A stable sort keeps each key's postings in (document, sentence) order
+	keys, postings = sort_postings(keys, postings)
+	unique_keys, starts = np.unique(keys, return_index=True)
+
+	segment_dir = mkdtemp(prefix="segment-", dir=index_dir)
+	np.save( path.join(segment_dir, "keys.npy"), unique_keys )
+	np.save( path.join(segment_dir, "offsets.npy"), np.append(starts, len(keys)).astype(np.int64) )
+	np.save( path.join(segment_dir, "postings.npy"), postings )
+	with open( path.join(segment_dir, "meta.json"), "w" ) as out:
+		json.dump( {"bits": bits, "vocabulary_size": vocabulary_size}, out )
+	return path.basename(segment_dir)
+
+def replace_lines(file_path, lines):
+	'''Read in a path and a list of strings, and write_lines() them to a temporary file that then replaces the path, so readers never see a partial file'''
+	write_lines(file_path + ".tmp", lines)
+	rename(file_path + ".tmp", file_path)
+
+###################
+# Segment Methods #
+###################
+
+def read_manifest(index_dir):
+	'''Read in an index directory and return its manifest: the names of its live segments and the number of vocabulary words and documents they cover'''
+	with open( path.join(index_dir, "manifest.json") ) as f:
+		return json.load(f)
+
+def write_manifest(index_dir, manifest):
+	'''Read in an index directory and a manifest, and replace the directory's manifest with it in a single rename'''
+	temporary_path = path.join(index_dir, "manifest.json." + str(getpid()) + ".tmp")
+	with open(temporary_path, "w") as out:
+		json.dump(manifest, out)
+	rename( temporary_path, path.join(index_dir, "manifest.json") )
+
+@contextmanager
+def manifest_lock(index_dir, lock_name="manifest.lock", wait=True):
+	'''Read in an index directory and hold a lock file in it for the duration of a with block; if `wait` is False and the lock is taken, yield False instead of waiting'''
+	lock_path = path.join(index_dir, lock_name)
+	locked    = False
+	while not locked:
+		try:
+			os.close( os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY) )
+			locked = True
+		except OSError:
+			if not wait:
+				break
+			time.sleep(.05)
+	try:
+		yield locked
+	finally:
+		if locked:
+			remove(lock_path)
+
+def merge_segments(index_dir):
+	'''Read in an index directory and merge all of its current segments into one, unless another merge is already running'''
+	with manifest_lock(index_dir, "merge.lock", wait=False) as locked:
+		if not locked:
+			return
+
+		index = load_index(index_dir)
+		if len(index["segments"]) < 2:
+			return
+
+		# Keys packed with fewer bits per id are unpacked and packed again with the widest segment's bits
+		bits     = max(segment["bits"] for segment in index["segments"])
+		keys     = []
+		postings = []
+		for segment in index["segments"]:
+			ngram_rows = unpack_ngrams(segment["keys"], segment["bits"], index["ngram_size"])
+			lengths    = np.diff(segment["offsets"])
+			keys.append( pack_ngrams(np.repeat(ngram_rows, lengths, axis=0), bits) )
+			postings.append( np.asarray(segment["postings"]) )
+		vocabulary_size = max(segment["vocabulary_size"] for segment in index["segments"])
+		segment_name    = write_segment( index_dir, np.concatenate(keys), np.concatenate(postings), bits, vocabulary_size )
+
+		# Segments added while the merge ran are kept after the merged one
+		merged = set(segment["name"] for segment in index["segments"])
+		with manifest_lock(index_dir):
+			manifest = read_manifest(index_dir)
+			manifest["segments"] = [segment_name] + [name for name in manifest["segments"] if name not in merged]
+			write_manifest(index_dir, manifest)
+
+		for name in merged:
+			shutil.rmtree( path.join(index_dir, name) )
+
+def merge_in_background(index_dir):
+	'''Read in an index directory and start a separate process that merges its segments, without waiting for that process to finish'''
+	Popen( [sys.executable, path.abspath(__file__), "merge", index_dir], close_fds=True )
+
+###################
+# Loading Methods #
+###################
+
+def load_segment(index_dir, segment_name):
+	'''Read in an index directory and the name of one of its segments, and return a dictionary holding that segment's parameters and memory-mapped arrays'''
+	segment_dir = path.join(index_dir, segment_name)
+	with open( path.join(segment_dir, "meta.json") ) as f:
+		segment = json.load(f)
+	segment["name"] = segment_name
+	for array_name in ["keys", "offsets", "postings"]:
+		segment[array_name] = np.load( path.join(segment_dir, array_name + ".npy"), mmap_mode="r" )
+	return segment
+
+def load_index(index_dir):
+	'''Read in an index directory and return a dictionary holding its parameters, vocabulary, document paths and segments'''
+	with open( path.join(index_dir, "meta.json") ) as f:
+		index = json.load(f)
+	manifest = read_manifest(index_dir)
+	index["vocabulary"]  = read_lines( path.join(index_dir, "vocabulary.txt") )[:manifest["vocabulary_size"]]
+	index["documents"]   = read_lines( path.join(index_dir, "documents.txt") )[:manifest["documents"]]
+	index["word_to_int"] = dict( (w, i) for i, w in enumerate(index["vocabulary"]) )
+	index["segments"]    = [load_segment(index_dir, segment_name) for segment_name in manifest["segments"]]
+	index["index_dir"]   = index_dir
+	return index
+
+def indexed_sentences(index, document_id):
+	'''Read in a loaded index and the id of one of its documents, and return the DocumentSentences of that document, which read each sentence from the file only when it is asked for'''
+	byte_spans = np.load( path.join(index["index_dir"], "offsets", str(document_id) + ".npy"), mmap_mode="r" )
+	return DocumentSentences(index["documents"][document_id], byte_spans)
+
+#################
+# Query Methods #
+#################
+
+def count_distinct_rows(columns):
+	'''Read in a list of aligned arrays and return the distinct rows they form, sorted, along with the number of times each row occurs'''
+	order   = np.lexsort(columns[::-1])
+	columns = [column[order] for column in columns]
+	new_row = np.zeros(len(order), dtype=bool)
+	new_row[:1] = True
+	for column in columns:
+		new_row[1:] |= column[1:] != column[:-1]
+	starts  = np.flatnonzero(new_row)
+	return [column[starts] for column in columns], np.diff( np.append(starts, len(order)) )
+
+def count_index_matches(segment, keys, sentence_ids):
+	'''Read in a loaded segment and sorted (keys, sentence_ids) postings for a query, and return (query sentence, document, sentence) arrays for every pair that shares ngrams along with their counts'''
+	query_keys, starts, lengths = np.unique(keys, return_index=True, return_counts=True)
+	positions, found = find_keys(segment["keys"], query_keys)
+	positions = positions[found]
+
+	index_starts  = segment["offsets"][positions]
+	index_lengths = segment["offsets"][positions + 1] - index_starts
+	query_rows, index_rows = expand_blocks(starts[found], lengths[found], index_starts, index_lengths)
+
+	postings = segment["postings"][index_rows]
+	return count_distinct_rows( [sentence_ids[query_rows], postings["document"], postings["sentence"]] )
+
+def query_index(index, tokens, chunk_size=1000, workers=1):
+	'''Read in a loaded index and the document_tokens() of a query text, and yield (query_sentence_id, document_id, sentence_id, count) tuples for every sentence pair sharing ngrams, streaming the query one chunk of sentences at a time'''
+	shared_ids = shared_token_ids(tokens, index["word_to_int"])
+	offsets    = tokens["sentence_offsets"]
+
+	for chunk_start in xrange(0, len(offsets) - 1, chunk_size):
+		id_lists = sentence_id_lists( shared_ids, offsets[chunk_start:chunk_start + chunk_size + 1] )
+		ngram_rows, sentence_ids = id_list_ngram_rows( id_lists, index["window_size"], index["step_size"], index["ngram_size"], workers )
+		sentence_ids = sentence_ids + chunk_start
+		columns      = [ [np.zeros(0, dtype=np.uint32)] for column in xrange(3) ]
+		counts       = [ np.zeros(0, dtype=np.int64) ]
+
+		# Each document lives in exactly one segment, so the segments' counts never need to be summed
+		for segment in index["segments"]:
+			# Ngrams holding words added after a segment was written cannot occur in it, and would not fit its keys
+			in_segment = (ngram_rows < segment["vocabulary_size"]).all(axis=1)
+			keys, segment_sentence_ids = sort_postings( pack_ngrams(ngram_rows[in_segment], segment["bits"]), sentence_ids[in_segment] )
+			segment_columns, segment_counts = count_index_matches(segment, keys, segment_sentence_ids)
+			for column, segment_column in zip(columns, segment_columns):
+				column.append(segment_column)
+			counts.append(segment_counts)
+
+		columns = [np.concatenate(column) for column in columns]
+		counts  = np.concatenate(counts)
+		order   = np.lexsort(columns[::-1])
+		for row in zip( *[column[order].tolist() for column in columns + [counts]] ):
+			yield row
+
+def index_match_lines(index, text_file, tokens, matches, threshold=5, max_open_documents=256):
+	'''Read in a loaded index, the path of the query text and its document_tokens(), and the rows yielded by query_index(), and yield the matches.txt line of each sentence pair that shares more than `threshold` ngrams'''
+	query_sentences    = document_sentences(text_file, tokens)
+	library_sentences  = {}
+
+	try:
+		for query_sentence_id, document_id, sentence_id, count in matches:
+			if count > threshold:
+				if document_id not in library_sentences:
+					# Each open document holds a file handle, so they are all closed once too many are open
+					if len(library_sentences) >= max_open_documents:
+						close_documents(library_sentences)
+					library_sentences[document_id] = indexed_sentences(index, document_id)
+
+				yield (
+					text_file + "\t" +
+					index["documents"][document_id] + "\t" +
+					unicode(count) + "\t" +
+					query_sentences[query_sentence_id] + "\t" +
+					library_sentences[document_id][sentence_id] + "\n"
+					)
+	finally:
+		close_documents(library_sentences)
+
+def close_documents(open_documents):
+	'''Read in a dictionary of DocumentSentences, close each of them, and empty the dictionary'''
+	for sentences in open_documents.values():
+		sentences.close()
+	open_documents.clear()
+
+def write_index_matches(index, text_files, workers=1, threshold=5, tokens=None):
+	'''Read in a loaded index, a list of query paths and optionally their document_tokens(), and write the sentence pairs of each query and the indexed texts that share more than `threshold` ngrams to disk; queries without tokens are cleaned one at a time'''
+	with codecs.open("matches.txt",'w','utf-8') as out:
+		for i, text_file in enumerate(text_files):
+			text_tokens = tokens[i] if tokens is not None else document_tokens(text_file, workers)
+			for line in index_match_lines( index, text_file, text_tokens, query_index(index, text_tokens, workers=workers), threshold ):
+				out.write(line)
+
+def parse_arguments():
+	'''Read the command line arguments and return them as a namespace'''
+	parser     = argparse.ArgumentParser(description="Index a reference corpus once, then query new texts against it")
+	subparsers = parser.add_subparsers(dest="command")
+
+	build = subparsers.add_parser("build", help="write an ngram index for one or more reference texts")
+	build.add_argument("index_dir", help="directory in which the index will be written")
+	build.add_argument("window_size", type=int, help="the size of the sliding window to be created")
+	build.add_argument("step_size", type=int, help="number of words to advance the sliding window when it moves")
+	build.add_argument("ngram_size", type=int, help="number of words to include in each ngram")
+	build.add_argument("text_files", nargs="+", help="paths to the reference texts")
+	build.add_argument("--workers", type=int, default=1, help="number of processes used to clean sentences and generate ngrams (default 1)")
+
+	add = subparsers.add_parser("add", help="compare new texts with the indexed texts, then add them to the index as a new segment")
+	add.add_argument("index_dir", help="directory containing an index written by `build`")
+	add.add_argument("text_files", nargs="+", help="paths to the new texts")
+	add.add_argument("--workers", type=int, default=1, help="number of processes used to clean sentences and generate ngrams (default 1)")
+	add.add_argument("--max-segments", type=int, default=MAX_SEGMENTS, help="merge the segments in the background once there are more than this many (default " + str(MAX_SEGMENTS) + ")")
+
+	merge = subparsers.add_parser("merge", help="merge the segments of an index into one")
+	merge.add_argument("index_dir", help="directory containing an index written by `build`")
+
+	query = subparsers.add_parser("query", help="find the sentences of a new text that share ngrams with the indexed texts")
+	query.add_argument("index_dir", help="directory containing an index written by `build`")
+	query.add_argument("text_file", help="path to the text to be compared against the index")
+	query.add_argument("--workers", type=int, default=1, help="number of processes used to clean sentences and generate ngrams (default 1)")
+	return parser.parse_args()
+
+if __name__ == "__main__":
+
+	args = parse_arguments()
+
+	if args.command == "build":
+		build_index(args.index_dir, args.text_files, args.window_size, args.step_size, args.ngram_size, args.workers)
+	elif args.command == "add":
+		# The new texts are cleaned once, then compared with the index and added to it
+		tokens = [document_tokens(text_file, args.workers) for text_file in args.text_files]
+		write_index_matches( load_index(args.index_dir), args.text_files, args.workers, tokens=tokens )
+		if add_texts(args.index_dir, args.text_files, args.workers, tokens) > args.max_segments:
+			merge_in_background(args.index_dir)
+	elif args.command == "merge":
+		merge_segments(args.index_dir)
+	else:
+		write_index_matches( load_index(args.index_dir), [args.text_file], args.workers )
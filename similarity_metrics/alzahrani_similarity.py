@@ -1,7 +1,14 @@
 from __future__ import division
 from nltk.stem.wordnet import WordNetLemmatizer
-from nltk.util import ngrams
-import codecs, sys, itertools, regex
+from os import path
+from window_scores import window_maxima, window_sums
+from synonym_index import load_synonym_index
+from batch_scoring import score_rows
+import numpy as np
+import codecs, sys, itertools, regex, argparse
+
+sys.path.append( path.join(path.dirname(path.abspath(__file__)), "..") )
+from word_memo import WordMemo
 
 ###################
 # Build Functions #
@@ -13,10 +20,6 @@ def generate_stopwords():
 		stopwords = set(stopwords_in.read().split())
 		return stopwords
 
-def remove_stopwords(s):
-	'''read in a string and return the split string without stopwords'''
-	return [x for x in s.lower().split() if x not in stopwords and len(x) > 1]
-    
 def remove_punctuation(s):
 	'''read in a string and return that strip without any punctuation except the hyphen and en-dash'''
 	return regex.sub(ur"[^\P{P}-']+", " ", s)
@@ -24,30 +27,16 @@ def remove_punctuation(s):
 def lemmatize_word(w):
 	return lemmatizer.lemmatize(w)	
 	
+def normalize_word(w):
+	'''read in a lowercase word and return it lemmatized, or None if it is a stopword'''
+	if w in stopwords or len(w) <= 1:
+		return None
+	return lemmatize_word(w)
+	
 def preprocess_string(s):
 	'''read in a string, return the string without stop words punctuation in lowercase form'''
-	return [ lemmatize_word(w) for w in remove_stopwords(remove_punctuation(s).lower()) ]
+	return word_memo.normalize_words( remove_punctuation(s).lower().split() )
 	
-def generate_synonym_dict(synonym_matrix):
-	'''read in a tab-separated file wherein the first column of each row contains a word and all subsequent columns contain its synonyms'''
-	with codecs.open(synonym_matrix,"r","utf-8") as synonyms_in:
-		synonym_dict     = {}
-		synonyms_in = synonyms_in.read().split("\n")
-		for row_count, row in enumerate(synonyms_in):
-			try:
-				split_row = row.split("\t")
-				synonym_dict[split_row[0]] = split_row[1:]
-			except:
-				print "There was trouble reading row", row_count, "of your synonym matrix. That row was skipped."
-	return synonym_dict
-	
-def find_synonyms(word):
-	'''read in a word and return its list of synonyms'''
-	try:
-		return synonym_dict[word]
-	except:
-		return [word]
-
 def is_iterable(object):
 	'''read in an object and return True if that object is iterable, otherwise return False'''
 	try:
@@ -68,14 +57,14 @@ def alzahrani_similarity(a, b, preprocess=1, length_normalize=1):
 		a = preprocess_string(a)
 		b = preprocess_string(b)
 	
-	for aw in a:
-		if aw in b:
-			similarity += 1
-		else:
-			for bw in b:	
-				if aw in find_synonyms( bw ):
-					similarity += .5
-					break		
+	ids_a, ids_b = synonym_index.encode(a, b)
+	exact      = np.in1d(ids_a, ids_b)
+	similarity = int( exact.sum() )
+	
+	# Each word of a that is not in b but is a synonym of some word of b adds half a point
+	synonyms = int( (synonym_index.synonym_mask(ids_a, ids_b).any(axis=1) & ~exact).sum() )
+	if synonyms:
+		similarity += .5 * synonyms
 					
 	if length_normalize == 1:
 		try:
@@ -85,67 +74,86 @@ def alzahrani_similarity(a, b, preprocess=1, length_normalize=1):
 	else:
 		return similarity	
 		
-def alzahrani_window_similarity(a_string, b_string, window_length, preprocess=1, window_length_normalize=1):
-	'''read in two strings a,b and integer window_length and return the maximum alwhazari similarity across subwindows of the specified length'''
-	a_windows      = list( ngrams( preprocess_string(a_string), window_length ) )
-	b_windows      = list( ngrams( preprocess_string(b_string), window_length ) )
-	max_similarity = 0
+def token_scores(a, b):
+	'''read in two lists of preprocessed words and return the (len(a) x len(b)) array of the score alzahrani_similarity() gives each word of a for each word of b: 1 for the same word, .5 for one of its synonyms, else 0'''
+	ids_a, ids_b = synonym_index.encode(a, b)
+	scores = np.where( synonym_index.synonym_mask(ids_a, ids_b), .5, 0 )
+	scores[ ids_a[:, None] == ids_b[None, :] ] = 1
+	return scores
+
+def alzahrani_window_similarities(a, b, max_window_length):
+	'''read in two lists of preprocessed words a,b and the longest window length, and return the list of the highest alzahrani similarity of any two windows of each length from 1 to max_window_length, scoring each pair of words only once'''
+	similarities = [0] * max_window_length
 	
-	for a_window in a_windows:
-		for b_window in b_windows:						
-			sim = alzahrani_similarity( list(a_window), list(b_window), preprocess=0, length_normalize=window_length_normalize )
-			if sim > max_similarity:
-				max_similarity = sim
-				
-	return max_similarity
+	# A word of a scores the best of its scores against the words of a window of b, so a window pair scores the sum of those best scores over the window of a
+	for window_length, maxima in window_maxima( token_scores(a, b), max_window_length ):
+		if window_length <= len(a):
+			max_similarity = window_sums(maxima, window_length).max()
+			
+			# A length at which no window pair scores above 0 keeps the integer 0
+			if max_similarity > 0:
+				similarities[window_length - 1] = float(max_similarity) / window_length
+	return similarities
 	
-def run_calculations(text_to_analyze):
-	'''Main function called below: reads in texts and runs similarity calculations'''
-	with codecs.open("similarity_scores.txt","w","utf-8") as out:
-		with codecs.open(text_to_analyze, "r", "utf-8") as infile:
-			infile_rows = infile.read().split("\n")[:-1]
-			for row_number, row in enumerate(infile_rows):
-				
-				'''To obtain only the aggregate similarity score, one can run just the following line:
-				print row_number, alzahrani_similarity(split_row[1], split_row[2])'''
-				
-				''' The following block allows one to measure the degree of separation as the subwindow size increases:'''
-				
-				print "Processing row", row_number
-				
-				try:
-					split_row = row.split("\t")
-					
-					if row_number <= 24:
-						groundtruth = 1
-					else:
-						groundtruth = 0
-					
-					shorter_row_text_length = min(  len(preprocess_string(split_row[1])), len(preprocess_string(split_row[2])) )
-					
-					for i in xrange( shorter_row_text_length - 1 ):
-						desired_window_length = 1+i
-					
-						out.write( unicode(row_number) + "\t" + 
-						unicode(groundtruth) + "\t" + 
-						unicode(desired_window_length) + "\t" +
-						unicode(alzahrani_similarity(split_row[1], split_row[2])) + "\t" +
-						unicode(alzahrani_window_similarity(split_row[1], split_row[2], desired_window_length)) + "\n")
-				
-				except Exception as exc:
-					print "There was an error reading row", row_number, "from the text_to_analyze. That row was skipped. Exception:", exc
-					
+def score_row(numbered_row):
+	'''read in a (row number, row) pair of the text_to_analyze, preprocess its two sentences once, and return the similarity_scores.txt lines of the row'''
+	row_number, row = numbered_row
+	
+	'''To obtain only the aggregate similarity score, one can return just the following value:
+	alzahrani_similarity(split_row[1], split_row[2])'''
+	
+	''' The following block allows one to measure the degree of separation as the subwindow size increases:'''
+	
+	try:
+		split_row = row.split("\t")
+		
+		if row_number <= 24:
+			groundtruth = 1
+		else:
+			groundtruth = 0
+		
+		a = preprocess_string(split_row[1])
+		b = preprocess_string(split_row[2])
+		
+		shorter_row_text_length = min( len(a), len(b) )
+		aggregate_similarity    = alzahrani_similarity(a, b, preprocess=0)
+		window_similarities     = alzahrani_window_similarities(a, b, shorter_row_text_length - 1)
+		
+		lines = []
+		for i in xrange( shorter_row_text_length - 1 ):
+			desired_window_length = 1+i
+		
+			lines.append( unicode(row_number) + "\t" + 
+			unicode(groundtruth) + "\t" + 
+			unicode(desired_window_length) + "\t" +
+			unicode(aggregate_similarity) + "\t" +
+			unicode(window_similarities[i]) + "\n")
+		return u"".join(lines)
+	
+	except Exception as exc:
+		print "There was an error reading row", row_number, "from the text_to_analyze. That row was skipped. Exception:", exc
+		return u""
+
+def parse_arguments():
+	'''read the command line arguments and return them as a namespace'''
+	parser = argparse.ArgumentParser(description="Measure the Alzahrani similarity of the two sentences in each row of a tab-separated file, for the whole sentences and for their windows of every length")
+	parser.add_argument("synonym_dictionary", help="tab-separated file in which the first cell of each row contains a word and all subsequent cells contain synonyms for that word, or the .npz index synonym_index.py compiles from such a file")
+	parser.add_argument("text_to_analyze", help="tab-separated file in which the second and third cells of each row contain the two sentences to be compared")
+	parser.add_argument("--output", default="similarity_scores.txt", help="file to which the scores of every row are written (default similarity_scores.txt)")
+	parser.add_argument("--workers", type=int, default=1, help="number of processes used to score rows (default 1)")
+	parser.add_argument("--resume", action="store_true", help="continue an interrupted run from the row recorded in output.checkpoint instead of starting over")
+	return parser.parse_args()
+
 ##################
 # Define Globals #
 ##################
 
-if len(sys.argv) != 3:
-	print "\nThis script requires as input two infiles. The first is a tab-separated file in which the first cell of each row contains a word and all subsequent cells contain synonyms for that word. This file = {synonym_dictionary} below. The second required file is a tab-separated matrix in which each row contains two sentences to be compared during the analysis. This file = {text_to_analyze} below.\n\nTo run the script, please use:  python alwhazari_similarity.py {synonym_dictionary} {text_to_analyze}"
-	sys.exit()
-
-lemmatizer       = WordNetLemmatizer()
-stopwords        = generate_stopwords()	
-synonym_dict     = generate_synonym_dict( sys.argv[1] )
-text_to_analyze  = sys.argv[2]
+if __name__ == "__main__":
 
-run_calculations(text_to_analyze)
\ No newline at end of file
+	args             = parse_arguments()
+	lemmatizer       = WordNetLemmatizer()
+	stopwords        = generate_stopwords()	
+	word_memo        = WordMemo(normalize_word)
+	synonym_index    = load_synonym_index( args.synonym_dictionary )
+	
+	score_rows(args.text_to_analyze, args.output, score_row, args.workers, args.resume)
@@ -0,0 +1,105 @@
+from multiprocessing import Pool
+from threading import Semaphore
+from os import path, rename, fsync
+
+'''Score the rows of a tab-separated pairs file in a process pool, writing each row's output lines in row order. Rows are
+read from disk only as fast as their scores are written, so memory stays flat however long the file is, and every
+`checkpoint_every` rows the number of the next row and the size of the output are recorded in a checkpoint file, from
+which an interrupted run can be resumed.'''
+
+class RowFeed(object):
+	'''An iterable over (row number, row) pairs that holds back the next row while `limit` rows are still waiting to be written'''
+
+	def __init__(self, rows, limit):
+		'''Read in an iterable of rows and the most rows to have in flight at once'''
+		self.rows   = rows
+		self.slots  = Semaphore(limit)
+		self.closed = False
+
+	def __iter__(self):
+		'''Yield the rows, waiting for a free slot before each'''
+		for row in self.rows:
+			self.slots.acquire()
+			if self.closed:
+				return
+			yield row
+
+	def written(self):
+		'''Record that the output of one more row has been written'''
+		self.slots.release()
+
+	def close(self):
+		'''Stop feeding rows, releasing the pool's task thread if it is waiting for a slot'''
+		self.closed = True
+		self.slots.release()
+
+def iter_rows(pairs_path, start_row=0):
+	'''Read in the path of a UTF-8 file and the number of its first wanted row, and yield (row number, row) for that row and every later one, reading one line at a time; as when the whole file is split on newlines and the piece after the last one dropped, only lines ending in a newline are rows'''
+	with open(pairs_path, "rb") as f:
+		for row_number, line in enumerate(f):
+			if not line.endswith(b"\n"):
+				break
+			if row_number >= start_row:
+				yield row_number, line[:-1].decode("utf-8")
+
+def read_checkpoint(checkpoint_path):
+	'''Read in the path of a checkpoint file and return the number of the first row not yet scored and the size the output file had once every earlier row was written'''
+	if not path.exists(checkpoint_path):
+		return 0, 0
+	with open(checkpoint_path, "rb") as f:
+		next_row, output_length = f.read().split()
+	return int(next_row), int(output_length)
+
+def write_checkpoint(checkpoint_path, next_row, output_length):
+	'''Read in the path of a checkpoint file, the number of the first row not yet scored and the size of the output written so far, and replace the checkpoint only once the new one is on disk'''
+	temp_path = checkpoint_path + ".tmp"
+	with open(temp_path, "wb") as f:
+		f.write( str(next_row) + "\t" + str(output_length) + "\n" )
+		f.flush()
+		fsync(f.fileno())
+	rename(temp_path, checkpoint_path)
+
+def score_rows(pairs_path, output_path, score_row, workers=1, resume=False, checkpoint_every=1000, chunk_size=4):
+	'''Read in the path of a pairs file, the path of the output file, a function that reads in a (row number, row) pair and returns the unicode output lines of that row, a number of workers and whether to resume from the checkpoint output_path.checkpoint, and write the output of every row to the output file in row order. With more than one worker, `score_row` must be a module-level function; the workers are forked, so they share everything loaded before the call'''
+	checkpoint_path = output_path + ".checkpoint"
+	next_row, output_length = read_checkpoint(checkpoint_path) if resume else (0, 0)
+
+	# Discard anything written after the last checkpoint; the rows it belonged to will be scored again
+	with open(output_path, "ab") as out:
+		out.truncate(output_length)
+	write_checkpoint(checkpoint_path, next_row, output_length)
+
+	rows = iter_rows(pairs_path, next_row)
+	if workers > 1:
+		feed    = RowFeed( rows, workers * chunk_size * 4 )
+		pool    = Pool(workers)
+		results = pool.imap(score_row, feed, chunk_size)
+	else:
+		feed    = None
+		pool    = None
+		results = (score_row(row) for row in rows)
+
+	try:
+		with open(output_path, "ab") as out:
+			for lines in results:
+				lines = lines.encode("utf-8")
+				out.write(lines)
+				output_length += len(lines)
+				next_row      += 1
+				if feed is not None:
+					feed.written()
+
+				if next_row % checkpoint_every == 0:
+					out.flush()
+					fsync(out.fileno())
+					write_checkpoint(checkpoint_path, next_row, output_length)
+					print "Scored", next_row, "rows"
+
+			out.flush()
+			fsync(out.fileno())
+			write_checkpoint(checkpoint_path, next_row, output_length)
+	finally:
+		if pool is not None:
+			feed.close()
+			pool.terminate()
+			pool.join()
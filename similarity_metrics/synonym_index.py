@@ -0,0 +1,110 @@
+from os import path, rename
+import numpy as np
+import codecs, argparse
+
+'''Compile a tab-separated synonym matrix, in which the first cell of each row holds a word and the following cells its
+synonyms, into a compressed sparse row adjacency over integer word ids. The compiled index is saved as a .npz file next to
+the matrix and loaded from there until the matrix changes, so the matrix is parsed only once, and the words of a text are
+compared as integer arrays rather than by scanning Python lists of synonyms.'''
+
+class SynonymIndex(object):
+	'''The vocabulary of a synonym matrix along with, for every word id, the sorted ids of that word's synonyms'''
+
+	def __init__(self, words, indptr, indices):
+		'''Read in the array of vocabulary words, the offset at which each word's synonym ids begin (followed by the end of the last word's), and the synonym ids themselves'''
+		self.words   = words
+		self.indptr  = indptr
+		self.indices = indices
+		self.word_id = dict( (word, word_id) for word_id, word in enumerate(words) )
+
+	def encode(self, *word_lists):
+		'''Read in one or more lists of words and return a list holding the array of ids of each; a word the matrix never mentions gets a temporary id past the vocabulary, which has no synonyms and is shared by every list of the same call but by no other call'''
+		unseen   = {}
+		id_lists = []
+		for words in word_lists:
+			ids = np.zeros(len(words), dtype=np.int64)
+			for i, word in enumerate(words):
+				word_id = self.word_id.get(word)
+				if word_id is None:
+					word_id = unseen.setdefault(word, len(self.word_id) + len(unseen))
+				ids[i] = word_id
+			id_lists.append(ids)
+		return id_lists
+	
+	def synonyms(self, ids):
+		'''Read in an array of word ids and return the positions in that array and the synonym ids of every synonym of those words, one pair per synonym'''
+		positions    = np.flatnonzero( ids < len(self.indptr) - 1 )
+		starts       = self.indptr[ ids[positions] ]
+		counts       = self.indptr[ ids[positions] + 1 ] - starts
+		run_offsets  = np.cumsum(counts) - counts
+		offsets      = np.arange(counts.sum(), dtype=np.int64) + np.repeat(starts - run_offsets, counts)
+		return np.repeat(positions, counts), self.indices[offsets]
+
+	def synonym_mask(self, ids_a, ids_b):
+		'''Read in two arrays of word ids and return the (len(ids_a) x len(ids_b)) boolean array that is True where a word of a is one of the synonyms of a word of b'''
+		distinct_a, rows_a = np.unique(ids_a, return_inverse=True)
+		positions_b, synonym_ids = self.synonyms(ids_b)
+		found = np.searchsorted(distinct_a, synonym_ids)
+		known = found < len(distinct_a)
+		known[known] = distinct_a[ found[known] ] == synonym_ids[known]
+
+		mask = np.zeros( (len(distinct_a), len(ids_b)), dtype=bool )
+		mask[ found[known], positions_b[known] ] = True
+		return mask[rows_a]
+
+	def save(self, index_path):
+		'''Read in a path and save the index there, replacing any earlier index only once the new one is complete'''
+		temp_path = index_path + ".tmp.npz"
+		np.savez_compressed(temp_path, words=self.words, indptr=self.indptr, indices=self.indices)
+		rename(temp_path, index_path)
+
+def read_synonym_matrix(synonym_matrix):
+	'''Read in the path of a tab-separated synonym matrix and return a dictionary mapping each word to the list of its synonyms; when a word heads several rows, the last row wins'''
+	synonym_dict = {}
+	with codecs.open(synonym_matrix, "r", "utf-8") as synonyms_in:
+		for row in synonyms_in.read().split("\n"):
+			split_row = row.split("\t")
+			synonym_dict[split_row[0]] = split_row[1:]
+	return synonym_dict
+
+def compile_synonym_index(synonym_matrix):
+	'''Read in the path of a tab-separated synonym matrix and return a SynonymIndex of its words and synonyms'''
+	synonym_dict = read_synonym_matrix(synonym_matrix)
+	words        = sorted( set(synonym_dict) | set(synonym for synonyms in synonym_dict.itervalues() for synonym in synonyms) )
+	word_ids     = dict( (word, word_id) for word_id, word in enumerate(words) )
+
+	indptr  = np.zeros(len(words) + 1, dtype=np.int64)
+	indices = []
+	for word_id, word in enumerate(words):
+		indices.extend( sorted(set( word_ids[synonym] for synonym in synonym_dict.get(word, []) )) )
+		indptr[word_id + 1] = len(indices)
+	return SynonymIndex( np.array(words, dtype=unicode), indptr, np.array(indices, dtype=np.int64) )
+
+def load_synonym_index(synonym_path):
+	'''Read in the path of a compiled .npz index or of a tab-separated synonym matrix, and return its SynonymIndex; a matrix is compiled and saved alongside itself as matrix.npz unless an index at least as new as the matrix is already there'''
+	if synonym_path.endswith(".npz"):
+		index_path = synonym_path
+	else:
+		index_path = synonym_path + ".npz"
+		if not path.exists(index_path) or path.getmtime(index_path) < path.getmtime(synonym_path):
+			index = compile_synonym_index(synonym_path)
+			try:
+				index.save(index_path)
+			except (IOError, OSError):
+				print "The compiled synonym index could not be saved to", index_path, "so the synonym matrix will be read again next time."
+			return index
+
+	with np.load(index_path) as index:
+		return SynonymIndex( index["words"], index["indptr"], index["indices"] )
+
+def parse_arguments():
+	'''Read the command line arguments and return them as a namespace'''
+	parser = argparse.ArgumentParser(description="Compile a tab-separated synonym matrix into a binary synonym index")
+	parser.add_argument("synonym_matrix", help="tab-separated file in which the first cell of each row holds a word and the following cells its synonyms")
+	parser.add_argument("output", nargs="?", help="path of the compiled index (default synonym_matrix.npz)")
+	return parser.parse_args()
+
+if __name__ == "__main__":
+
+	args = parse_arguments()
+	compile_synonym_index(args.synonym_matrix).save( args.output or args.synonym_matrix + ".npz" )
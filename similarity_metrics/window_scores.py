@@ -0,0 +1,28 @@
+from __future__ import division
+import numpy as np
+
+'''Score every pair of equal-length windows of two token lists from one matrix of token-to-token scores, for every window
+length at once. Once the (tokens_a x tokens_b) score matrix of a row has been computed, the best score of each token of a
+within every window of b grows by one column per window length, and the window totals are sliding sums of those best
+scores, so no window pair is ever rescored from its tokens.'''
+
+def window_maxima(scores, max_window_length):
+	'''Read in a (tokens_a x tokens_b) array of token scores and the longest window length, and yield each window length from 1 to max_window_length along with the (tokens_a x windows_b) array holding the best score of each token of a within each window of that many tokens of b'''
+	maxima = scores
+	for window_length in xrange(1, min(max_window_length, scores.shape[1]) + 1):
+		if window_length > 1:
+			maxima = np.maximum( maxima[:, :-1], scores[:, window_length - 1:] )
+		yield window_length, maxima
+
+def window_sums(values, window_length):
+	'''Read in a 2-D array and a window length, and return the sums of every run of `window_length` consecutive rows, computed as differences of prefix sums'''
+	totals = np.cumsum( np.vstack((np.zeros((1, values.shape[1])), values)), axis=0 )
+	return totals[window_length:] - totals[:-window_length]
+
+def ordered_window_sums(values, window_length):
+	'''Read in a 2-D array and a window length, and return the sums of every run of `window_length` consecutive rows, adding the rows of each run in order so that every total is the same float as a left-to-right sum of its run'''
+	window_count = values.shape[0] - window_length + 1
+	totals       = values[:window_count].copy()
+	for offset in xrange(1, window_length):
+		totals += values[offset:offset + window_count]
+	return totals
@@ -1,11 +1,17 @@
 from __future__ import division
-from sklearn.metrics.pairwise import cosine_similarity
-from gensim.models.word2vec import Word2Vec
 from nltk.stem.wordnet import WordNetLemmatizer
 from nltk.corpus import stopwords
 from nltk.util import ngrams
 from logging import basicConfig, INFO
-import codecs, os, regex
+import numpy as np
+import codecs, os, sys, regex, argparse
+
+sys.path.append( os.path.join(os.path.dirname(os.path.abspath(__file__)), "..") )
+from word_memo import WordMemo
+from batch_scoring import score_rows, iter_rows
+from word_vectors import WordVectors
+from line_files import write_lines
+from window_scores import window_maxima, window_sums, ordered_window_sums
 
 ###########################
 # String Cleaning Methods #
@@ -15,10 +21,6 @@ def load_stopwords():
 	'''Return the NLTK's English stopwords list'''
 	return set(stopwords.words('english'))
 
-def remove_stopwords(s):
-	'''Read in a string and return that word as a split list without stopwords'''
-	return [w for w in s if w not in stops and len(w) > 2]
-	
 def lemmatize_word(w):
 	'''Read in a single word and return it in its lemmatized state'''
 	return lemmatizer.lemmatize(w)
@@ -44,12 +46,17 @@ def standardize_spelling(w):
 	except:
 		return w	
 	
+def normalize_word(w):
+	'''Read in a lowercase word and return it with its spelling standardized and lemmatized, or None if it is a stopword'''
+	w = standardize_spelling(w)
+	if w in stops or len(w) <= 2:
+		return None
+	return lemmatize_word(w)
+	
 def preprocess_text(s):
 	'''Read in a string, lowercase, strip punctuation, remove duplicates, standardize spelling, then lemmatize each word, and return a tuple of words'''
 	l = remove_punctuation(s.lower()).split()
-	l = [standardize_spelling(w) for w in l]
-	l = remove_stopwords(l)	
-	l = [lemmatize_word(w) for w in l]
+	l = word_memo.normalize_words(l)
 	l = list(set(l))
 	return l
 
@@ -57,43 +64,50 @@ def preprocess_text(s):
 # Vector Loading and Processing #
 #################################
 
-def load_google_vectors():
-	'''Return the Google pretrained binary vectors for Word2Vec'''
-	return Word2Vec.load_word2vec_format('../google_pretrained_word_vectors/GoogleNews-vectors-negative300.bin.gz', binary=True)
-	
-def word2vec_word_comparison(w1, w2):
-	'''Read in two words from the word2vec_similarity() function and return their word similarity'''
-	if w1 == w2:
-		return 1
-	try:
-		v1 = model[ w1 ]
-		v2 = model[ w2 ]
-		return float( cosine_similarity(v1,v2)[0][0])
-		
-	#exceptions will occur if w1 or w2 are not in the Google pretrained vector list. 
-	except Exception as exc:
-		return 0		
+def load_word_vectors(prefix):
+	'''Read in the prefix of vectors exported by word_vectors.py (e.g. from the Google pretrained binary vectors for Word2Vec) and return them memory-mapped'''
+	return WordVectors(prefix)
 
-def word2vec_similarity(s1, s2, preprocess=1):
-	'''Read in two strings and return their length-normalized Word2Vec similarity value'''
-	string_similarity = []
+def write_vocabulary(pairs, vocabulary_path):
+	'''Read in the path of a pairs file and write the distinct preprocessed words of its strings to vocabulary_path, one per line, for word_vectors.py --vocabulary'''
+	vocabulary = set()
+	for count, row in iter_rows(pairs):
+		split_row = row.split("\t")
+		vocabulary.update( preprocess_text(split_row[1]) )
+		vocabulary.update( preprocess_text(split_row[2]) )
+	write_lines( vocabulary_path, sorted(vocabulary) )
 	
-	if preprocess == 1:
-		s1 = preprocess_text(s1)
-		s2 = preprocess_text(s2)
+def token_similarity_matrices(pairs):
+	'''Read in a list of (s1, s2) pairs of preprocessed word lists and return, for each pair, the (len(s1) x len(s2)) array of the cosine similarity of each word of s1 with each word of s2: 1 for the same word, and 0 when either word has no vector. The vectors of all the batch's distinct words are gathered from the memory map once, and each pair's similarities are one product of its two matrices of unit vectors'''
+	words   = sorted( set(w for pair in pairs for s in pair for w in s) )
+	known   = [w for w in words if w in model]
+	words   = known + [w for w in words if w not in model]
+	word_id = dict( (w, i) for i, w in enumerate(words) )
+	vectors = np.asarray( [model[w] for w in known], dtype=np.float64 ).reshape(len(known), -1)
 	
-	for ws1 in s1:
-		max_word_similarity = 0
-		max_similar_word    = u""
-		for ws2 in s2:
-			similarity = word2vec_word_comparison(ws1, ws2)
-			if similarity > max_word_similarity:
-				max_word_similarity = similarity
-				max_similar_word    = ws2
+	matrices = []
+	for s1, s2 in pairs:
+		ids1     = np.array( [word_id[w] for w in s1], dtype=np.int64 )
+		ids2     = np.array( [word_id[w] for w in s2], dtype=np.int64 )
+		known1   = np.flatnonzero( ids1 < len(known) )
+		known2   = np.flatnonzero( ids2 < len(known) )
 		
-		#because it's unfair to penalize a string for containing words not in the Google vectors, skip words with max_word_similarity == 0
-		if max_word_similarity > 0:
-			string_similarity.append( max_word_similarity )
+		#words that are not in the Google pretrained vector list score 0 against every word but themselves
+		matrix = np.zeros( (len(s1), len(s2)) )
+		matrix[ np.ix_(known1, known2) ] = np.dot( vectors[ ids1[known1] ], vectors[ ids2[known2] ].T )
+		matrix[ ids1[:, None] == ids2[None, :] ] = 1
+		matrices.append(matrix)
+	return matrices
+
+def mean_max_similarity(matrix, s1, s2):
+	'''Read in the token similarity matrix of two preprocessed word lists along with the lists themselves, and return the mean of the best similarity each word of s1 finds in s2'''
+	if len(s2):
+		max_word_similarities = matrix.max(axis=1)
+	else:
+		max_word_similarities = np.zeros( len(s1) )
+	
+	#because it's unfair to penalize a string for containing words not in the Google vectors, skip words with max_word_similarity == 0
+	string_similarity = max_word_similarities[ max_word_similarities > 0 ].tolist()
 	try:
 		return sum(string_similarity) / len(string_similarity)
 	
@@ -106,53 +120,109 @@ def word2vec_similarity(s1, s2, preprocess=1):
 		print "\n"
 		return 0
 
-def word2vec_window_similarity(s1, s2, window_length):
-	'''Read in two strings and a subwindow_length, and return the maximum similarity value for the subwindows of the specified length'''
-	s1_windows      = list( ngrams( preprocess_text( s1 ), window_length ) )
-	s2_windows      = list( ngrams( preprocess_text( s2 ), window_length ) )
+def word2vec_similarities(pairs):
+	'''Read in a list of (s1, s2) pairs of preprocessed word lists and return the list of their word2vec_similarity() values, computed as one batch'''
+	return [ mean_max_similarity(matrix, s1, s2) for matrix, (s1, s2) in zip(token_similarity_matrices(pairs), pairs) ]
+
+def word2vec_similarity(s1, s2, preprocess=1):
+	'''Read in two strings and return their length-normalized Word2Vec similarity value'''
+	if preprocess == 1:
+		s1 = preprocess_text(s1)
+		s2 = preprocess_text(s2)
+	return word2vec_similarities( [(s1, s2)] )[0]
+
+def word2vec_window_similarity(s1, s2, window_length, preprocess=1):
+	'''Read in two strings (or, with preprocess=0, two lists of preprocessed words) and a subwindow_length, and return the maximum similarity value for the subwindows of the specified length'''
+	if preprocess == 1:
+		s1 = preprocess_text(s1)
+		s2 = preprocess_text(s2)
+	
+	s1_windows      = list( ngrams( s1, window_length ) )
+	s2_windows      = list( ngrams( s2, window_length ) )
 	
 	max_window_similarity = 0
+	window_pairs          = [ (list(s1_window), list(s2_window)) for s1_window in s1_windows for s2_window in s2_windows ]
 	
-	for s1_window in s1_windows:
-		for s2_window in s2_windows:
-			
-			observed_similarity = word2vec_similarity( list(s1_window), list(s2_window), preprocess=0 )
-			
-			if observed_similarity > max_window_similarity:
-				max_window_similarity = observed_similarity
+	for observed_similarity in word2vec_similarities( window_pairs ):
+		if observed_similarity > max_window_similarity:
+			max_window_similarity = observed_similarity
 				
 	return max_window_similarity
 	
+def word2vec_window_similarities(matrix, max_window_length):
+	'''Read in the token similarity matrix of two preprocessed word lists and the longest window length, and return the list of word2vec_window_similarity() values for every window length from 1 to max_window_length, derived from that one matrix'''
+	similarities = [0] * max_window_length
+	
+	# The best similarity each word of s1 finds within each window of s2 grows by one column per window length, and a window pair scores the mean of the positive best similarities of its words of s1
+	for window_length, maxima in window_maxima( matrix, max_window_length ):
+		if window_length <= matrix.shape[0]:
+			positive = maxima > 0
+			counts   = window_sums( positive.astype(np.float64), window_length )
+			sums     = ordered_window_sums( np.where(positive, maxima, 0), window_length )
+			
+			# A window pair whose words of s1 find no positive similarity scores 0, as word2vec_similarity() does
+			scored = counts > 0
+			if scored.any():
+				max_window_similarity = ( sums[scored] / counts[scored] ).max()
+				if max_window_similarity > 0:
+					similarities[window_length - 1] = float(max_window_similarity)
+	return similarities
+
+def score_row(numbered_row):
+	'''Read in a (row number, row) pair of the pairs file, preprocess its two strings once, and return the word_to_vec_similarity_values.txt lines of the row'''
+	count, row = numbered_row
+	
+	#calculate aggregate similarity from the token similarity matrix of the row, which the window similarities share
+	split_row                = row.split("\t")
+	s1                       = preprocess_text( split_row[1] )
+	s2                       = preprocess_text( split_row[2] )
+	matrix                   = token_similarity_matrices( [(s1, s2)] )[0]
+	aggregate_similarity     = mean_max_similarity( matrix, s1, s2 )
+	
+	#calculate window similarity
+	shorter_row_text_length  = min( len(s1), len(s2) )
+	window_similarities      = word2vec_window_similarities( matrix, shorter_row_text_length - 1 )
+	window_similarity_tuples = []
+	
+	for i in xrange( shorter_row_text_length - 1 ):
+		desired_window_length = 1+i
+		window_similarity_tuples.append( (desired_window_length, window_similarities[i]) )
+	
+	#each window similarity tuple countains a window length and the maximum similarity observed for that window length. Write these in "long format" for ggplot
+	lines = []
+	for window_similarity_tuple in window_similarity_tuples:
+		lines.append( unicode(count) + "\t" + unicode(aggregate_similarity) + "\t" + unicode(window_similarity_tuple[0]) + "\t" +unicode(window_similarity_tuple[1]) + "\n")
+	return u"".join(lines)
+
+def parse_arguments():
+	'''Read the command line arguments and return them as a namespace'''
+	parser = argparse.ArgumentParser(description="Measure the Word2Vec similarity of the two strings in each row of a tab-separated file, for the whole strings and for their windows of every length")
+	parser.add_argument("pairs", nargs="?", default="goldsmith_french_to_english.csv", help="tab-separated file in which the second and third cells of each row contain the two strings to be compared (default goldsmith_french_to_english.csv)")
+	parser.add_argument("--output", default="word_to_vec_similarity_values.txt", help="file to which the scores of every row are written (default word_to_vec_similarity_values.txt)")
+	parser.add_argument("--workers", type=int, default=1, help="number of processes used to score rows (default 1)")
+	parser.add_argument("--resume", action="store_true", help="continue an interrupted run from the row recorded in output.checkpoint instead of starting over")
+	parser.add_argument("--vectors", default="../google_pretrained_word_vectors/GoogleNews-vectors-negative300", help="prefix of the vectors exported by word_vectors.py (default ../google_pretrained_word_vectors/GoogleNews-vectors-negative300)")
+	parser.add_argument("--write-vocabulary", metavar="PATH", help="write the preprocessed words of the pairs file to PATH, for pruning the exported vectors with word_vectors.py --vocabulary, and exit without scoring")
+	return parser.parse_args()
+
 ###########
 # Globals #
 ###########
 
-basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=INFO)
+if __name__ == "__main__":
 
-stops       = load_stopwords()
-lemmatizer  = WordNetLemmatizer()
-ortho_dict  = create_ortho_dict()
-model       = load_google_vectors()	
+	args        = parse_arguments()
+	basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=INFO)
+
+	stops       = load_stopwords()
+	lemmatizer  = WordNetLemmatizer()
+	ortho_dict  = create_ortho_dict()
+	word_memo   = WordMemo(normalize_word)
 	
-with codecs.open("word_to_vec_similarity_values.txt","w","utf-8") as out:
-	with codecs.open("goldsmith_french_to_english.csv","r","utf-8") as goldy:
-		goldy = goldy.read().split("\n")
-		for count, row in enumerate(goldy[:-1]):
-		
-			#calculate aggregate similarity
-			split_row                = row.split("\t")
-			aggregate_similarity     = word2vec_similarity( split_row[1], split_row[2] )
-			
-			#calculate window similarity
-			shorter_row_text_length  = min(  len(preprocess_text(split_row[1])), len(preprocess_text(split_row[2])) )
-			window_similarity_tuples = []
-			
-			for i in xrange( shorter_row_text_length - 1 ):
-				desired_window_length = 1+i
-			
-				max_window_similarity = word2vec_window_similarity(split_row[1], split_row[2], desired_window_length)
-				window_similarity_tuples.append( (desired_window_length, max_window_similarity) )
-			
-			#each window similarity tuple countains a window length and the maximum similarity observed for that window length. Write these in "long format" for ggplot
-			for window_similarity_tuple in window_similarity_tuples:
-				out.write( unicode(count) + "\t" + unicode(aggregate_similarity) + "\t" + unicode(window_similarity_tuple[0]) + "\t" +unicode(window_similarity_tuple[1]) + "\n")
\ No newline at end of file
+	if args.write_vocabulary:
+		write_vocabulary(args.pairs, args.write_vocabulary)
+		sys.exit()
+	
+	model       = load_word_vectors(args.vectors)
+	
+	score_rows(args.pairs, args.output, score_row, args.workers, args.resume)
@@ -0,0 +1,87 @@
+from os import path, rename
+import numpy as np
+import codecs, sys, argparse
+
+sys.path.append( path.join(path.dirname(path.abspath(__file__)), "..") )
+from cleaning_resources import compile_table, CompiledTable
+
+'''Export pretrained word vectors once to a float32 matrix of unit-length rows (prefix.npy) and a sorted string table of
+its words (prefix.vocab.keys.bin and prefix.vocab.keys.offsets.npy), optionally keeping only the words of a given
+vocabulary. The rows follow the order of the table, so a word's row is its position in the table. Scorers memory-map both
+instead of loading the vectors through gensim, so startup reads nothing but the headers, and every process on a machine
+reads the same pages rather than holding its own copy.'''
+
+class WordVectors(object):
+	'''The unit-length vectors of an exported vocabulary and the sorted table of its words, both memory-mapped'''
+
+	def __init__(self, prefix):
+		'''Read in the prefix of an exported matrix and word table'''
+		self.vectors = np.load(prefix + ".npy", mmap_mode="r")
+		self.words   = CompiledTable( path.dirname(prefix), path.basename(prefix) + ".vocab" )
+		if len(self.words.keys) != len(self.vectors):
+			raise ValueError(prefix + ".npy and " + prefix + ".vocab come from different exports")
+
+	def __contains__(self, word):
+		'''Read in a word and return True if it has a vector'''
+		return self.words.find(word) >= 0
+
+	def __getitem__(self, word):
+		'''Read in a word and return its unit-length vector, raising a KeyError if it has none'''
+		row = self.words.find(word)
+		if row < 0:
+			raise KeyError(word)
+		return self.vectors[row]
+
+def export_vectors(words, vectors, prefix, vocabulary=None, chunk_size=100000):
+	'''Read in the list of words of a model, the (words x dimensions) array of their vectors, an output prefix and an optional set of the words to keep, and write the normalized vectors of the kept words a chunk at a time to prefix.npy, in the order of the table of the words themselves that compile_table() writes to prefix.vocab, returning the number of words written'''
+	keep = [ word_id for word_id, word in enumerate(words) if vocabulary is None or word in vocabulary ]
+	keep.sort( key=lambda word_id: words[word_id].encode("utf-8") )
+
+	temp_path = prefix + ".tmp.npy"
+	matrix    = np.lib.format.open_memmap( temp_path, mode="w+", dtype=np.float32, shape=(len(keep), vectors.shape[1]) )
+	for chunk_start in xrange(0, len(keep), chunk_size):
+		chunk  = np.asarray( vectors[ keep[chunk_start:chunk_start + chunk_size] ], dtype=np.float64 )
+		norms  = np.sqrt( (chunk * chunk).sum(axis=1) )
+		norms[norms == 0] = 1
+		matrix[chunk_start:chunk_start + len(chunk)] = chunk / norms[:, None]
+	matrix.flush()
+	del matrix
+
+	# The table is written under a temporary name and renamed after the matrix, so the two are only replaced once both are complete
+	export_dir, name = path.split(prefix)
+	compile_table( export_dir, name + ".vocab.tmp", [words[word_id] for word_id in keep] )
+	rename(temp_path, prefix + ".npy")
+	for suffix in [".keys.bin", ".keys.offsets.npy"]:
+		rename(prefix + ".vocab.tmp" + suffix, prefix + ".vocab" + suffix)
+	return len(keep)
+
+def export_word2vec_model(model_path, prefix, vocabulary=None, binary=True):
+	'''Read in the path of a word2vec format model, an output prefix and an optional set of the words to keep, and export the model's vectors, returning the number of words written'''
+	# gensim is only needed for the one-time export, not by the scorers that read its output
+	from gensim.models.word2vec import Word2Vec
+	model = Word2Vec.load_word2vec_format(model_path, binary=binary)
+	return export_vectors(model.index2word, model.syn0, prefix, vocabulary)
+
+def read_vocabulary(vocabulary_paths):
+	'''Read in a list of paths of UTF-8 files and return the set of the whitespace-separated words they contain'''
+	vocabulary = set()
+	for vocabulary_path in vocabulary_paths:
+		with codecs.open(vocabulary_path, "r", "utf-8") as f:
+			for line in f:
+				vocabulary.update( line.split() )
+	return vocabulary
+
+def parse_arguments():
+	'''Read the command line arguments and return them as a namespace'''
+	parser = argparse.ArgumentParser(description="Export word2vec format vectors to a memory-mappable matrix of unit-length float32 rows and a word list")
+	parser.add_argument("model", help="word2vec format model, e.g. GoogleNews-vectors-negative300.bin.gz")
+	parser.add_argument("prefix", help="prefix of the exported files: prefix.npy holds the vectors and prefix.vocab.keys.bin and prefix.vocab.keys.offsets.npy the words")
+	parser.add_argument("--vocabulary", nargs="+", help="files of whitespace-separated words (such as those written by word_to_vec_similarity.py --write-vocabulary); only these words are exported")
+	parser.add_argument("--text", action="store_true", help="the model is in the text rather than the binary word2vec format")
+	return parser.parse_args()
+
+if __name__ == "__main__":
+
+	args       = parse_arguments()
+	vocabulary = read_vocabulary(args.vocabulary) if args.vocabulary else None
+	print "Exported", export_word2vec_model(args.model, args.prefix, vocabulary, binary=not args.text), "words to", args.prefix + ".npy"
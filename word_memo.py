@@ -0,0 +1,50 @@
+'''Memoize per-word normalization chains (spelling standardization, stopword filtering, lemmatization, frequency filtering)
+so that each distinct surface form in a text is normalized once rather than once per occurrence.'''
+
+class WordMemo(object):
+	'''Map each distinct surface form to the id of its normalized form in a table of normalized words'''
+
+	def __init__(self, normalize, max_size=1000000):
+		'''Read in a function that maps a surface form to its normalized form (or to None if the form should be dropped), and the maximum number of surface forms to remember'''
+		self.normalize  = normalize
+		self.max_size   = max_size
+		self.form_to_id = {}
+		self.words      = []
+		self.word_to_id = {}
+
+	def add(self, form):
+		'''Read in a surface form that is not yet memoized, normalize it, and return the id of its normalized form (-1 if it is dropped), or None if the memo is full'''
+		if len(self.form_to_id) >= self.max_size:
+			return None
+
+		word = self.normalize(form)
+		if word is None:
+			word_id = -1
+		else:
+			word_id = self.word_to_id.get(word)
+			if word_id is None:
+				word_id = len(self.words)
+				self.words.append(word)
+				self.word_to_id[word] = word_id
+
+		self.form_to_id[form] = word_id
+		return word_id
+
+	def normalize_words(self, forms):
+		'''Read in a list of surface forms and return the list of their normalized forms, without the forms that normalize to None'''
+		words = []
+		for form in forms:
+			word_id = self.form_to_id.get(form)
+			if word_id is None:
+				word_id = self.add(form)
+
+				# Once the memo is full, forms it has never seen are normalized on every occurrence
+				if word_id is None:
+					word = self.normalize(form)
+					if word is not None:
+						words.append(word)
+					continue
+
+			if word_id >= 0:
+				words.append( self.words[word_id] )
+		return words